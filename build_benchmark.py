@@ -4,23 +4,55 @@ import subprocess
 import argparse
 import shutil
 import configparser
+import collections
+import datetime
+import array
+import re
+import hashlib
+import json
+import contextlib
+import tempfile
+import multiprocessing
+import threading
+import time
+import traceback
+
+from git_access import GitRepo
+from git_access import GitError
+
+# history rewriting engines:
+#   filter-repo - git-filter-repo, orphan checkout + rebase, then cherry-picks
+#   plumbing    - git-filter-repo, then git commit-tree on existing trees
+#   stream      - one git fast-export | git fast-import pass
+ENGINES = ['filter-repo', 'plumbing', 'stream']
 
 class ChronbenchBenchmark:
     '''
     Manipulate Chronbench Benchmarks.
     '''
-    def __init__(self, benchmark_desc_file, relative_gfr_path, stats=False):
+    def __init__(self, benchmark_desc_file, relative_gfr_path, stats=False,
+                 engine='filter-repo', mirror_cache=None, build_cache=None):
         '''
         Initialize benchmark state
         '''
         self.gfr_path = relative_gfr_path
 
+        # history rewriting engine, one of ENGINES
+        self.engine = engine
+
+        # directory of bare upstream mirrors, or None to always clone repo_url
+        self.mirror_cache = mirror_cache
+
+        # directory of previously built benchmarks, or None to always build
+        self.build_cache = build_cache
+
         benchmark_desc = self._parse_benchmark_desc_file(benchmark_desc_file)
         self.name = benchmark_desc.sections()[0]
         self.benchmark = benchmark_desc[self.name]
 
         # If True write out a file with some statistics about the benchmark
         self._stats = stats
+        self.commit_stats = None
 
         # create variables for all the mandatory benchmark description fields
         self.repo_url = self.benchmark['url']
@@ -37,11 +69,31 @@ class ChronbenchBenchmark:
 
         self.phony_author = 'Chronbench <chronbench@email.com>'
 
+        # created on first use, the benchmark directory may not exist yet
+        self._git = None
+
     def build_benchmark(self):
         '''
         Create a fresh benchmark. Result is an incremental benchmark repository.
         '''
 
+        # An identical benchmark may all ready have been built
+        if self.build_cache is not None and self._restore_cached_build():
+            return
+
+        try:
+            self._build_benchmark()
+        finally:
+            self.git.close()
+
+        if self.build_cache is not None:
+            self._store_cached_build()
+
+    def _build_benchmark(self):
+        '''
+        Build the benchmark repository from its upstream repository.
+        '''
+
         # Step 0 - Get a fresh copy of the upstream repo, and reset it to a
         # known base commit
         self._clone_upstream_repository()
@@ -50,20 +102,35 @@ class ChronbenchBenchmark:
         if self._stats:
             self._count_hardware_commits()
 
+        # Steps 1-3 in a single fast-export/fast-import pass
+        if self.engine == 'stream':
+            self._rewrite_history_stream()
+            if self._stats:
+                self._dump_stats_file()
+            return
+
         self._run_cmd('git reset --hard '+self.base_sha)
 
         # Step 1 - Reduce the upstream repo to the Fileset of Interest
         self._reduce_to_fileset_of_interest()
 
-        # Step 2 - Reduce upstream repo to the Window of Interest
-        self._reduce_to_window_of_interest()
-
         # If stats are on collect sattistics on the interesting commits
         if self._stats:
             self._count_interesting_commits()
 
+        # Step 2 - Reduce upstream repo to the Window of Interest
+        if self.engine == 'plumbing':
+            self._reduce_to_window_of_interest_plumbing()
+        else:
+            self._reduce_to_window_of_interest()
+
         # Step 3 - Squash unsynthesizable commits
-        self._squash_unsynthesizable_commits()
+        if self.engine == 'plumbing':
+            self._squash_unsynthesizable_commits_plumbing()
+            # the plumbing only wrote objects and refs, update the checkout
+            self._run_cmd('git checkout -q -f '+self.branch)
+        else:
+            self._squash_unsynthesizable_commits()
 
         if self._stats:
             self._dump_stats_file()
@@ -88,98 +155,100 @@ class ChronbenchBenchmark:
         config.read(benchmark_desc_file)
         return config
 
-    def _run_cmd(self, cmd):
+    @property
+    def git(self):
+        '''
+        Git access layer (git_access.GitRepo) for the benchmark directory
+        '''
+        if self._git is None:
+            self._git = GitRepo(self.name)
+        return self._git
+
+    def _run_cmd(self, cmd, check=False):
         '''
         Run a shell command in the benchmark directory. If cmd is a string
         split it on spaces. If it is a list leave it as is. Strings are easier
         to read, but lists allow for some command line fields to include spaces.
 
-        Returns stdout as a list of utf8 strings.
+        Returns stdout as a list of utf8 strings. If check is True raise a
+        GitError (with the command's stderr) if the command fails.
+        '''
+        return self.git.run(cmd, check=check)
+
+    def _stream_cmd(self, cmd):
+        '''
+        Run a command in the benchmark directory like _run_cmd, but yield
+        stdout one utf8 line at a time as it is produced, instead of holding
+        all of it in memory. Raises a GitError if the command fails.
         '''
-        if type(cmd) is not list:
-            cmd = cmd.split()
-        result = subprocess.run(cmd, cwd=self.name, capture_output=True)
-        result = result.stdout.decode('utf8').split('\n')
-        return result
+        return self.git.stream(cmd)
 
     def _count_hardware_commits(self):
         '''
-        Record some commit statistics. Builds a dictionary with entries as:
-            <UNIX author timestamp>: [<net change>, <touches hardware>, <in final benchmark>]
+        Record some commit statistics for every upstream commit in a
+        CommitStatistics index (see CommitStatistics for the columns).
         This is an instrumentation function, and is not run unless statistic
         reporting is on.
         '''
-        self._stats = {}
+        self.commit_stats = CommitStatistics()
 
         # output of the follwing git log is formatted as:
         #
-        # <UNIX timestamp>
-        # <filename>
+        # \0<sha> <UNIX timestamp>
+        # <insertions>\t<deletions>\t<filename>
         # ...
-        # <filename>
+        # <insertions>\t<deletions>\t<filename>
         #
         # ...
         #
-        # commits that do not change files (some merges) do not have a newline
-        # after the timestamp:
-        # <UNIX timestamp>
-        # ...
-        all_commits = self._run_cmd('git log --reflog --name-only --format=format:%at')
-        ts = None
+        # commits that do not change files (some merges) have no numstat
+        # lines. Binary files are counted with '-' insertions and deletions.
+        all_commits = self._stream_cmd(['git', 'log', '--reflog', '--numstat',
+                                        '--format=format:%x00%H %at'])
+        row = None
         for line in all_commits:
-            try:
-                ts = int(line)
-                self._stats[ts] = [None, False, False]
-            except ValueError:
-                if len(line) != 0:
-                    filetype = line.split('.')[-1]
-                    if filetype in ['v', 'vh', 'sv', 'svh', 'vhd']:
-                        self._stats[ts][1] = True
-        # output of the follwing git log is formatted as:
-        #
-        # <UNIX timestamp>
-        # x file[s] changed, [y insertion[s](+),] [z deletion[s](-)]
-        #
-        # ...
-        # commits that do not change files don't have newlines as above
-        all_changes = self._run_cmd('git log --reflog --shortstat --format=format:%at')
-        ts = None
-        for line in all_changes:
-            try:
-                ts = int(line)
-            except ValueError:
-                if len(line) != 0:
-                    net = 0
-                    for change in line.split(',')[1:]:
-                        if '+' in change:
-                            net = net + int(change.split()[0])
-                        else:
-                            net = net + int(change.split()[0])
-                    self._stats[ts][0] = net
+            if line.startswith('\0'):
+                sha, ts = line[1:].split()
+                row = self.commit_stats.add(sha, int(ts))
+            elif len(line) != 0 and row is not None:
+                insertions, deletions, filename = line.split('\t', 2)
+                net = 0
+                for change in [insertions, deletions]:
+                    if change != '-':
+                        net = net + int(change)
+                self.commit_stats.add_change(row, net, filename)
 
     def _count_interesting_commits(self):
         '''
-        Collect timestamps of all the interesting commits
+        Mark the upstream commits that end up in the benchmark. Must run
+        between steps 1 and 2: git-filter-repo records the upstream sha of
+        every commit it rewrites, and the Window of Interest (minus the stop
+        commit, which is replaced by a new root) is the newest <depth> - 1
+        commits.
+        '''
+        commit_map = {}
+        with open(os.path.join(self.name, '.git', 'filter-repo', 'commit-map'), 'r') as cm:
+            for line in cm:
+                old, new = line.split()
+                commit_map[new] = old
+
+        window = self._run_cmd('git rev-list --first-parent -n '+str(int(self.depth) - 1)+' '+self.branch)
+        self._mark_interesting_commits([commit_map[sha] for sha in window if sha in commit_map])
 
-        set self._stats[<UNIX author timestamp>][2] = True
+    def _mark_interesting_commits(self, upstream_shas):
         '''
-        interesting_timestamps = self._run_cmd('git log --format=format:%at')
-        for its in interesting_timestamps:
-            try:
-                self._stats[int(its)][2] = True
-            except KeyError:
-                # the first commit in the WoI is new, and therefore not in
-                # the upstream history
-                pass
+        Mark each upstream sha in upstream_shas as part of the benchmark
+        '''
+        for sha in upstream_shas:
+            self.commit_stats.mark_in_benchmark(sha)
 
     def _dump_stats_file(self):
         '''
-        Write the stats dictionary to a file
+        Write the statistics to a file, one commit per line formatted as:
+            <UNIX author timestamp> <net change> <touches hardware> <in final benchmark>
         '''
         with open(self.name + '_statistics.txt', 'w') as statfile:
-            for key, value in self._stats.items():
-                statfile.write(str(key))
-                statfile.write(' ')
+            for value in self.commit_stats.rows():
                 for item in value:
                     statfile.write(str(item))
                     statfile.write(' ')
@@ -201,7 +270,142 @@ class ChronbenchBenchmark:
             exit()
 
         # clone the repo
-        subprocess.run(['git', 'clone', self.repo_url])
+        if self.mirror_cache is None:
+            subprocess.run(['git', 'clone', self.repo_url, self.name])
+            return
+
+        # clone from the local mirror. A local clone hardlinks the object
+        # store, so this is cheap, and the result is an ordinary standalone
+        # repository as far as git-filter-repo is concerned
+        mirror = self._update_mirror()
+        subprocess.run(['git', 'clone', mirror, self.name])
+        self._run_cmd(['git', 'remote', 'set-url', 'origin', self.repo_url])
+
+    def _build_cache_key(self):
+        '''
+        Hash everything that determines the contents of the benchmark
+        repository: the build fields of the description, the engine, the
+        version of git-filter-repo, and the version of this script.
+        '''
+        key = {
+            'url': self.repo_url,
+            'start': self.base_sha,
+            'branch': self.branch,
+            'depth': self.depth,
+            'fileset': self.fileset,
+            'squash-list': self.squash_list,
+            'engine': self.engine,
+            'git-filter-repo': self._gfr_version(),
+            'script': self._script_version(),
+        }
+        key = json.dumps(key, sort_keys=True).encode('utf8')
+        return self.name+'-'+hashlib.sha256(key).hexdigest()[:16]
+
+    def _script_version(self):
+        '''
+        A hash of this file, which implements the engines
+        '''
+        with open(os.path.abspath(__file__), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:12]
+
+    def _gfr_version(self):
+        '''
+        Return the version of git-filter-repo in the same form as
+        `git filter-repo --version`, which is a hash of the script itself.
+        The stream engine does not use git-filter-repo.
+        '''
+        if self.engine == 'stream' or self.gfr_path is None:
+            return None
+        try:
+            with open(os.path.join(self.gfr_path, 'git_filter_repo.py'), 'rb') as gfr:
+                return hashlib.sha1(gfr.read()).hexdigest()[:12]
+        except FileNotFoundError:
+            return 'unknown'
+
+    def _restore_cached_build(self):
+        '''
+        Restore the benchmark repository from the build cache.
+
+        Returns True if an identical build was found and restored.
+        '''
+        key = self._build_cache_key()
+        bundle = os.path.join(self.build_cache, key+'.bundle')
+        stats_file = os.path.join(self.build_cache, key+'_statistics.txt')
+
+        if os.path.isdir(self.name) or not os.path.isfile(bundle):
+            return False
+        if self._stats and not os.path.isfile(stats_file):
+            return False
+
+        subprocess.run(['git', 'clone', '-q', '--branch', self.branch, bundle, self.name])
+        self._run_cmd(['git', 'remote', 'set-url', 'origin', self.repo_url])
+        if self._stats:
+            shutil.copyfile(stats_file, self.name+'_statistics.txt')
+        print('Restored '+self.name+' from build cache ('+key+')')
+        return True
+
+    def _store_cached_build(self):
+        '''
+        Store the benchmark branch (and statistics file) in the build cache.
+        Files are written under temporary names and then renamed, so that
+        concurrent builds never see a partial entry.
+        '''
+        os.makedirs(self.build_cache, exist_ok=True)
+        key = self._build_cache_key()
+        bundle = os.path.abspath(os.path.join(self.build_cache, key+'.bundle'))
+        tmp = bundle+'.'+str(os.getpid())
+
+        self._run_cmd(['git', 'bundle', 'create', '-q', tmp, 'refs/heads/'+self.branch])
+        if self._stats:
+            stats_file = os.path.join(self.build_cache, key+'_statistics.txt')
+            shutil.copyfile(self.name+'_statistics.txt', stats_file+'.'+str(os.getpid()))
+            os.replace(stats_file+'.'+str(os.getpid()), stats_file)
+        os.replace(tmp, bundle)
+
+    def _mirror_path(self):
+        '''
+        Return the path of the bare mirror of repo_url in the mirror cache.
+        Mirrors are keyed by url, so benchmarks with the same upstream share a
+        mirror.
+        '''
+        url_hash = hashlib.sha1(self.repo_url.encode('utf8')).hexdigest()[:12]
+        repo = os.path.basename(self.repo_url.rstrip('/'))
+        if repo.endswith('.git'):
+            repo = repo[:-len('.git')]
+        return os.path.join(self.mirror_cache, repo+'-'+url_hash+'.git')
+
+    def _update_mirror(self):
+        '''
+        Make sure the mirror of repo_url contains the start commit. Create the
+        mirror if it does not exist, and only fetch from upstream if start is
+        missing.
+
+        Returns the path to the mirror
+        '''
+        # only available on POSIX, and only needed for the mirror cache
+        import fcntl
+
+        os.makedirs(self.mirror_cache, exist_ok=True)
+        mirror = self._mirror_path()
+
+        # builds of benchmarks with the same upstream may run concurrently
+        with open(mirror+'.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if not os.path.isdir(mirror):
+                subprocess.run(['git', 'clone', '--bare', self.repo_url, mirror])
+                subprocess.run(['git', 'config', 'remote.origin.fetch',
+                                '+refs/heads/*:refs/heads/*'], cwd=mirror)
+                return mirror
+
+            has_start = subprocess.run(['git', 'cat-file', '-e', self.base_sha+'^{commit}'],
+                                       cwd=mirror, capture_output=True)
+            if has_start.returncode != 0:
+                print('Updating mirror of '+self.repo_url)
+                subprocess.run(['git', 'fetch', '--prune', '--tags', 'origin'], cwd=mirror)
+            else:
+                print('Using mirror of '+self.repo_url+' at '+mirror)
+        return mirror
 
     def _reduce_to_fileset_of_interest(self):
         '''
@@ -252,7 +456,7 @@ class ChronbenchBenchmark:
         depth = str(int(self.depth) - 1)
 
         # get the stop hash
-        stop_sha = self._run_cmd('git show -s HEAD~'+depth+' --format=format:%H')[0]
+        stop_sha = self.git.objects.rev_parse('HEAD~'+depth)
 
         # create an orphan branch based on the stop commit
         self._run_cmd('git checkout --orphan '+new_branch+' '+stop_sha)
@@ -285,7 +489,7 @@ class ChronbenchBenchmark:
 
         # get the hash of each commit in the squash list
         for sidx in self.squash_list:
-            sha = self._run_cmd('git show -s HEAD~'+sidx+' --format=format:%H')[0]
+            sha = self.git.objects.rev_parse('HEAD~'+sidx)
             squash_shas.append(sha)
 
         # get hashes for all of the interesting commits
@@ -319,6 +523,490 @@ class ChronbenchBenchmark:
         self._run_cmd('git branch -D '+self.branch)
         self._run_cmd('git branch -m '+new_branch+' '+self.branch)
 
+    def _read_commits(self, rev_args):
+        '''
+        Read the metadata of the commits selected by rev_args (a list of
+        `git log` arguments) with a single `git log`.
+
+        Returns a list of commits, youngest first, formatted as:
+            {'sha': <sha>, 'tree': <tree sha>, 'author': (<name>, <email>, <raw date>),
+             'message': <raw message>}
+        '''
+        cmd = ['git', 'log', '-z', '--format=format:%H%x00%T%x00%an%x00%ae%x00%ad%x00%B',
+               '--date=raw'] + rev_args
+        result = self.git.run_bytes(cmd)
+        fields = result.decode('utf8', 'surrogateescape').split('\0')
+        commits = []
+        for fidx in range(0, len(fields) - 5, 6):
+            sha, tree, name, email, date, message = fields[fidx:fidx+6]
+            commits.append({'sha': sha, 'tree': tree, 'author': (name, email, date),
+                            'message': message})
+        return commits
+
+    def _commit_tree(self, tree, parents, message, author):
+        '''
+        Write a commit object for an existing tree without touching the index
+        or the working tree. author is a tuple of (<name>, <email>, <date>),
+        a date of None means now. The committer is the local user, as it would
+        be for a rebase or cherry-pick.
+
+        Returns the sha of the new commit.
+        '''
+        cmd = ['git', 'commit-tree', tree]
+        for p in parents:
+            cmd = cmd + ['-p', p]
+        env = dict(os.environ)
+        env['GIT_AUTHOR_NAME'] = author[0]
+        env['GIT_AUTHOR_EMAIL'] = author[1]
+        env.pop('GIT_AUTHOR_DATE', None)
+        if author[2] is not None:
+            env['GIT_AUTHOR_DATE'] = author[2]
+        try:
+            result = self.git.run_bytes(cmd, env=env, check=True,
+                                        input=message.encode('utf8', 'surrogateescape'))
+        except GitError as err:
+            print("QUITTING: "+str(err))
+            exit()
+        return result.decode('utf8').strip()
+
+    def _phony_author_ident(self):
+        '''
+        Split the phony author into a (<name>, <email>, <date>) tuple, dated
+        now like `git commit --author`
+        '''
+        name, email = self.phony_author.split(' <')
+        return (name, email.rstrip('>'), None)
+
+    def _rebase_keeps_empty(self):
+        '''
+        Returns True if `git rebase` keeps commits that do not change the tree,
+        as it does by default since git 2.26. Older versions drop them.
+        '''
+        version = self._run_cmd('git --version')[0].split()[2]
+        major, minor = [int(v) for v in version.split('.')[:2]]
+        return (major, minor) >= (2, 26)
+
+    def _reduce_to_window_of_interest_plumbing(self):
+        '''
+        Plumbing version of _reduce_to_window_of_interest. Write a new root
+        commit with the tree of HEAD~<depth - 1>, then re-create each younger
+        commit on top of it with `git commit-tree`, reusing its tree object.
+        Nothing is checked out, and the index is not modified.
+
+        The window is followed along first parents. Commits that do not
+        change the tree are kept or dropped as the installed git's rebase does,
+        so for a linear history (what git-filter-repo typically produces for
+        the Fileset of Interest) the trees and messages are the same as the
+        rebase produces.
+        '''
+        window = self._read_commits(['--first-parent', '-n', str(self.depth), self.branch])
+        window.reverse()
+
+        parent = self._commit_tree(window[0]['tree'], [], 'new root\n',
+                                   self._phony_author_ident())
+        keep_empty = self._rebase_keeps_empty()
+        tree = window[0]['tree']
+        for commit in window[1:]:
+            if commit['tree'] == tree and not keep_empty:
+                continue
+            parent = self._commit_tree(commit['tree'], [parent], commit['message'],
+                                       commit['author'])
+            tree = commit['tree']
+
+        self._run_cmd('git update-ref refs/heads/'+self.branch+' '+parent)
+
+    def _squash_unsynthesizable_commits_plumbing(self):
+        '''
+        Plumbing version of _squash_unsynthesizable_commits. Replays the same
+        sequence of cherry-picks and squashes with `git commit-tree`, so each
+        commit is a single object write instead of a checkout. Squash commits
+        get the message `git merge --squash` would have produced, built from
+        commits read through the repository's cat-file reader. Commits that do
+        not change the tree are left out, as their cherry-pick fails.
+        '''
+        # not all benchmarks have squash lists
+        if self.squash_list is None:
+            return
+
+        squash_list = [int(sidx) for sidx in self.squash_list]
+
+        # get all of the interesting commits, oldest first
+        unsquashed = self._read_commits([self.branch])
+        unsquashed.reverse()
+
+        parent = unsquashed[0]['sha']
+        tree = unsquashed[0]['tree']
+        to_squash = False
+        for cidx in range(1, len(unsquashed)):
+            commit = unsquashed[cidx]
+            # cherry-picking a commit that does not change the tree fails, so
+            # it is left out
+            new = parent
+            if commit['tree'] != tree:
+                new = self._commit_tree(commit['tree'], [parent], commit['message'],
+                                        commit['author'])
+                tree = commit['tree']
+
+            # Does the last commit need to be squashed into the one just applied
+            base = self.git.objects.rev_parse(new+'~2') if to_squash else None
+            if base is not None:
+                squashed = []
+                sha = new
+                while sha != base:
+                    obj = self.git.objects.commit(sha)
+                    squashed.append({'oid': sha,
+                                     'author': obj['author'].encode('utf8', 'surrogateescape'),
+                                     'message': obj['message'].encode('utf8', 'surrogateescape')})
+                    sha = obj['parents'][0]
+                message = _squash_message(squashed).decode('utf8')
+                new = self._commit_tree(tree, [base], _cleanup_message(message),
+                                        self._phony_author_ident())
+            parent = new
+
+            # check if the commit we just applied needs to be squashed
+            to_squash = (len(unsquashed) - 1 - cidx) in squash_list
+
+        self._run_cmd('git update-ref refs/heads/'+self.branch+' '+parent)
+
+    def _rewrite_history_stream(self):
+        '''
+        Single pass replacement for steps 1-3. Read `git fast-export` of the
+        start commit once, apply the Fileset of Interest, flattening, Window of
+        Interest and squash-list in memory, and write the benchmark branch with
+        a single `git fast-import`.
+
+        History is followed along first parents, which is the same chain that
+        HEAD~<N> indexes in the depth and squash-list fields. Blobs are not
+        exported (--no-data) since they already exist in the repository that
+        is being imported into.
+        '''
+        window = self._read_window_of_interest()
+
+        # If stats are on collect statistics on the interesting commits. The
+        # new root is not an upstream commit, so it is not counted.
+        if self._stats:
+            self._mark_interesting_commits([c['oid'] for c in window[1:]])
+
+        self._write_window_of_interest(window)
+
+        # the fast-import only wrote objects and refs, update the checkout
+        self._run_cmd('git checkout -q -f '+self.branch)
+
+    def _flatten_path(self, path):
+        '''
+        Map an upstream path onto its flattened name in the Fileset of
+        Interest, using the same matching rules as `--path-match` and
+        `--path-rename` in git-filter-repo.
+
+        Returns None if path is not in the Fileset of Interest.
+        '''
+        for f in self.fileset:
+            f = f.encode('utf8')
+            if path == f:
+                return os.path.basename(f)
+            prefix = f.rstrip(b'/') + b'/'
+            if path.startswith(prefix):
+                return os.path.basename(f.rstrip(b'/')) + b'/' + path[len(prefix):]
+        return None
+
+    def _read_window_of_interest(self):
+        '''
+        Stream the fast-export of the start commit and keep the last <depth>
+        commits that modify the Fileset of Interest, or that were all ready
+        empty upstream and follow a commit that was kept (git-filter-repo keeps
+        those).
+
+        Returns a list of commits, oldest first, formatted as:
+            {'oid': <upstream sha>, 'author': <ident>, 'message': <bytes>,
+             'files': {<flattened path>: (<mode>, <blob sha>)}}
+        '''
+        cmd = ['git', 'fast-export', '--no-data', '--reencode=yes',
+               '--show-original-ids', '--signed-tags=strip',
+               '--first-parent', self.base_sha]
+        proc = subprocess.Popen(cmd, cwd=self.name, stdout=subprocess.PIPE)
+        stream = proc.stdout
+
+        # only the newest <depth> interesting commits are ever needed
+        window = collections.deque(maxlen=int(self.depth))
+        files = {}
+        # whether the previous commit was pruned
+        pruned = False
+        line = stream.readline()
+        while line:
+            if not line.startswith(b'commit '):
+                line = stream.readline()
+                continue
+
+            commit = {'oid': None, 'author': None, 'message': b''}
+            changed = False
+            touched = False
+            line = stream.readline()
+            while line:
+                if line.startswith(b'original-oid '):
+                    commit['oid'] = line.split()[1].decode('utf8')
+                elif line.startswith(b'author '):
+                    commit['author'] = line[len(b'author '):].rstrip(b'\n')
+                elif line.startswith(b'data '):
+                    commit['message'] = stream.read(int(line.split()[1]))
+                elif line.startswith(b'M '):
+                    touched = True
+                    mode, sha, path = line[2:].rstrip(b'\n').split(b' ', 2)
+                    path = self._flatten_path(_unquote_path(path))
+                    # gitlinks are not part of a synthesizable fileset
+                    if path is not None and mode != b'160000':
+                        if files.get(path) != (mode, sha):
+                            files[path] = (mode, sha)
+                            changed = True
+                elif line.startswith(b'D '):
+                    touched = True
+                    path = self._flatten_path(_unquote_path(line[2:].rstrip(b'\n')))
+                    if path is not None and path in files:
+                        del files[path]
+                        changed = True
+                elif line.startswith(b'deleteall'):
+                    touched = True
+                    if len(files) != 0:
+                        files = {}
+                        changed = True
+                elif not (line.startswith(b'mark ') or
+                          line.startswith(b'committer ') or
+                          line.startswith(b'encoding ') or
+                          line.startswith(b'from ') or
+                          line.startswith(b'merge ') or
+                          line == b'\n'):
+                    # start of the next command
+                    break
+                elif line == b'\n' and commit['author'] is not None:
+                    # blank line after the file changes ends the commit
+                    line = stream.readline()
+                    break
+                line = stream.readline()
+
+            # commits that do not modify the Fileset of Interest are pruned,
+            # like git-filter-repo does. It keeps commits that were empty
+            # upstream, unless their parent was pruned, so they count towards
+            # the depth.
+            pruned = not (changed or (not touched and not pruned))
+            if not pruned:
+                commit['files'] = dict(files)
+                window.append(commit)
+
+        proc.wait()
+        if proc.returncode != 0:
+            print("QUITTING: git fast-export failed in "+self.name)
+            exit()
+        return list(window)
+
+    def _write_window_of_interest(self, window):
+        '''
+        Write the Window of Interest to <branch> with `git fast-import`. The
+        oldest commit becomes a new root, and commits in the squash-list are
+        squashed into their oldest non-squash list successor.
+        '''
+        # the rebase onto the new root may drop the empty commits
+        if not self._rebase_keeps_empty():
+            kept = window[:1]
+            for commit in window[1:]:
+                if commit['files'] != kept[-1]['files']:
+                    kept.append(commit)
+            window = kept
+
+        squash_list = None
+        if self.squash_list is not None:
+            squash_list = [int(sidx) for sidx in self.squash_list]
+
+        # rebase and cherry-pick would commit as the local user, now
+        committer = self._run_cmd('git var GIT_COMMITTER_IDENT')[0].encode('utf8')
+        if len(committer) == 0:
+            print("QUITTING: no git committer identity configured")
+            exit()
+        now = committer.rsplit(b' ', 2)[1:]
+        phony_author = b' '.join([self.phony_author.encode('utf8')] + now)
+
+        # replay the cherry-picks and squashes of the squash-list on groups of
+        # commits, each group becomes one benchmark commit. Like a cherry-pick,
+        # a commit that does not change the files is left out, and a squash
+        # merges the last two groups (`git reset --hard HEAD~2`).
+        groups = [[window[widx]] for widx in range(1, len(window))]
+        if squash_list is not None:
+            groups = []
+            files = window[0]['files']
+            to_squash = False
+            for widx in range(1, len(window)):
+                if window[widx]['files'] != files:
+                    groups.append([window[widx]])
+                    files = window[widx]['files']
+                if to_squash and len(groups) >= 2:
+                    groups[-2:] = [groups[-2] + groups[-1]]
+                to_squash = (len(window) - 1 - widx) in squash_list
+
+        proc = subprocess.Popen(['git', 'fast-import', '--quiet', '--force'],
+                                cwd=self.name, stdin=subprocess.PIPE)
+        out = proc.stdin
+        ref = b'refs/heads/' + self.branch.encode('utf8')
+        out.write(b'reset ' + ref + b'\n')
+
+        files = {}
+        for mark, group in enumerate([None] + groups, start=1):
+            if group is None:
+                author = phony_author
+                message = b'new root\n'
+                new_files = window[0]['files']
+            elif len(group) == 1:
+                author = group[0]['author']
+                message = group[0]['message']
+                new_files = group[0]['files']
+            else:
+                author = phony_author
+                message = _squash_message(reversed(group))
+                new_files = group[-1]['files']
+
+            out.write(b'commit ' + ref + b'\n')
+            out.write(b'mark :' + str(mark).encode('utf8') + b'\n')
+            out.write(b'author ' + author + b'\n')
+            out.write(b'committer ' + committer + b'\n')
+            out.write(b'data ' + str(len(message)).encode('utf8') + b'\n')
+            out.write(message + b'\n')
+            if mark > 1:
+                out.write(b'from :' + str(mark - 1).encode('utf8') + b'\n')
+            for path in files:
+                if path not in new_files:
+                    out.write(b'D ' + _quote_path(path) + b'\n')
+            for path, (mode, sha) in new_files.items():
+                if files.get(path) != (mode, sha):
+                    out.write(b'M ' + mode + b' ' + sha + b' ' + _quote_path(path) + b'\n')
+            out.write(b'\n')
+            files = new_files
+
+        out.close()
+        proc.wait()
+        if proc.returncode != 0:
+            print("QUITTING: git fast-import failed in "+self.name)
+            exit()
+
+def _cleanup_message(message):
+    '''
+    Clean up a commit message the way `git commit` does by default: strip
+    trailing whitespace, collapse runs of empty lines, and drop leading and
+    trailing empty lines.
+    '''
+    lines = []
+    for line in message.split('\n'):
+        line = line.rstrip()
+        if len(line) == 0 and (len(lines) == 0 or len(lines[-1]) == 0):
+            continue
+        lines.append(line)
+    while len(lines) > 0 and len(lines[-1]) == 0:
+        lines.pop()
+    return '\n'.join(lines)+'\n'
+
+def _unquote_path(path):
+    '''
+    Undo the C-style quoting git applies to paths with special characters.
+    '''
+    if not path.startswith(b'"'):
+        return path
+    return path[1:-1].decode('unicode_escape').encode('latin1')
+
+def _quote_path(path):
+    '''
+    Quote a path for `git fast-import` if it could be misread.
+    '''
+    if not (path.startswith(b'"') or b'\n' in path):
+        return path
+    return b'"' + path.replace(b'\\', b'\\\\').replace(b'"', b'\\"').replace(b'\n', b'\\n') + b'"'
+
+def _format_git_date(timestamp, tz):
+    '''
+    Format a raw git date (<UNIX timestamp> <+hhmm offset>) the way
+    `git log --format=medium` does.
+    '''
+    sign = -1 if tz.startswith('-') else 1
+    offset = sign*(int(tz[1:3])*3600 + int(tz[3:5])*60)
+    date = datetime.datetime.fromtimestamp(int(timestamp),
+                                           datetime.timezone(datetime.timedelta(seconds=offset)))
+    return date.strftime('%a %b ')+str(date.day)+date.strftime(' %H:%M:%S %Y ')+tz
+
+def _squash_message(commits):
+    '''
+    Build a message in the format `git merge --squash` uses, listing commits
+    (youngest first) by their upstream sha.
+    '''
+    message = 'Squashed commit of the following:\n'
+    for commit in commits:
+        ident, timestamp, tz = commit['author'].decode('utf8').rsplit(' ', 2)
+        message = message + '\ncommit '+commit['oid']+'\n'
+        message = message + 'Author: '+ident+'\n'
+        message = message + 'Date:   '+_format_git_date(timestamp, tz)+'\n\n'
+        for line in commit['message'].decode('utf8').rstrip('\n').split('\n'):
+            message = message + ('    '+line).rstrip()+'\n'
+    return message.encode('utf8')
+
+
+class CommitStatistics:
+    '''
+    Per-commit statistics of an upstream repository, indexed by commit sha.
+    Stored as compact columns so repositories with 100k+ commits fit in
+    bounded memory:
+        timestamp - UNIX author timestamp
+        net       - lines inserted plus lines deleted (-1 if no files changed)
+        flags     - HDL_FLAG if the commit touches hardware files,
+                    BENCHMARK_FLAG if the commit is in the final benchmark
+    '''
+    HDL_EXTENSIONS = ['v', 'vh', 'sv', 'svh', 'vhd']
+    HDL_FLAG = 1
+    BENCHMARK_FLAG = 2
+
+    def __init__(self):
+        self.index = {}
+        self.timestamp = array.array('q')
+        self.net = array.array('q')
+        self.flags = bytearray()
+
+    def add(self, sha, timestamp):
+        '''
+        Add a commit, returns its row. Commits that are all ready indexed are
+        not added twice.
+        '''
+        key = bytes.fromhex(sha)
+        if key in self.index:
+            return self.index[key]
+        row = len(self.timestamp)
+        self.index[key] = row
+        self.timestamp.append(timestamp)
+        self.net.append(-1)
+        self.flags.append(0)
+        return row
+
+    def add_change(self, row, net, filename):
+        '''
+        Record that the commit at row changed filename by net lines
+        '''
+        self.net[row] = max(self.net[row], 0) + net
+        # renames are reported as 'old => new' or 'dir/{old => new}'
+        if ' => ' in filename:
+            filename = re.sub(r'{[^{}]* => ([^{}]*)}', r'\1', filename).split(' => ')[-1]
+        if filename.split('.')[-1] in self.HDL_EXTENSIONS:
+            self.flags[row] = self.flags[row] | self.HDL_FLAG
+
+    def mark_in_benchmark(self, sha):
+        '''
+        Flag the commit with the given sha as part of the final benchmark
+        '''
+        row = self.index.get(bytes.fromhex(sha))
+        if row is not None:
+            self.flags[row] = self.flags[row] | self.BENCHMARK_FLAG
+
+    def rows(self):
+        '''
+        Yield a list for each commit, in the order they were added, formatted as:
+            [<UNIX author timestamp>, <net change>, <touches hardware>, <in final benchmark>]
+        '''
+        for row in range(len(self.timestamp)):
+            net = self.net[row] if self.net[row] >= 0 else None
+            yield [self.timestamp[row], net,
+                   bool(self.flags[row] & self.HDL_FLAG),
+                   bool(self.flags[row] & self.BENCHMARK_FLAG)]
 
 def get_available_benchmarks(benchmark_dir):
     '''
@@ -335,6 +1023,148 @@ def get_available_benchmarks(benchmark_dir):
             benchmarks[os.path.splitext(b)[0]] = bpath
     return benchmarks
 
+@contextlib.contextmanager
+def _prefixed_output(prefix):
+    '''
+    Prefix every line written to stdout or stderr with `prefix`, including
+    output from subprocesses (git, git-filter-repo), until the context exits.
+    '''
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    out = os.fdopen(os.dup(1), 'wb')
+    read_fd, write_fd = os.pipe()
+
+    def pump():
+        with os.fdopen(read_fd, 'rb') as pipe:
+            for line in pipe:
+                out.write(prefix+line)
+                out.flush()
+
+    thread = threading.Thread(target=pump)
+    thread.start()
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+        # the pump exits once the last copy of the pipe is closed
+        thread.join()
+        out.close()
+
+def _build_suite_member(name, benchmark_desc_file, clean, options):
+    '''
+    Build (or clean) one benchmark of a suite build. Runs in a worker process
+    so that git-filter-repo changing the working directory cannot affect the
+    other benchmarks.
+
+    Returns a tuple of (<benchmark name>, <success>, <wall time>)
+    '''
+    start = time.time()
+    cwd = os.getcwd()
+    success = True
+    with _prefixed_output(('['+name+'] ').encode('utf8')):
+        try:
+            cbb = ChronbenchBenchmark(benchmark_desc_file, 'git-filter-repo', **options)
+            if clean:
+                cbb.cleanup_benchmark()
+            else:
+                cbb.build_benchmark()
+        except SystemExit:
+            # a QUITTING message has all ready been printed
+            success = False
+        except Exception:
+            traceback.print_exc()
+            success = False
+        finally:
+            os.chdir(cwd)
+    return (name, success, time.time() - start)
+
+def build_suite(benchmarks, jobs=1, clean=False, **options):
+    '''
+    Build (or clean) every benchmark in `benchmarks` (as returned by
+    get_available_benchmarks) using up to `jobs` worker processes. Each
+    benchmark is built in its own directory, and its output is prefixed with
+    its name. Prints a summary of the wall time for each benchmark.
+
+    Returns True if every benchmark succeeded.
+    '''
+    start = time.time()
+    work = [(name, path, clean, options) for name, path in sorted(benchmarks.items())]
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.starmap(_build_suite_member, work, chunksize=1)
+    elapsed = time.time() - start
+
+    print('Suite summary (wall time '+'{:.1f}'.format(elapsed)+'s):')
+    width = max([len(name) for name in benchmarks.keys()])
+    for name, success, member_elapsed in sorted(results, key=lambda r: -r[2]):
+        status = 'PASS' if success else 'FAIL'
+        print('    '+name.ljust(width)+'  '+status+'  '+'{:.1f}'.format(member_elapsed)+'s')
+    return all([r[1] for r in results])
+
+def _benchmark_history(path, branch):
+    '''
+    Read the tree and message of each commit of branch in the benchmark at
+    path, youngest first. Squash messages list commit hashes, which differ
+    between engines (and the stream engine lists the upstream commits), so
+    only their first line is kept.
+    '''
+    squash = 'Squashed commit of the following:'
+    log = GitRepo(path).run_bytes(['git', 'log', '-z', '--format=format:%T%x00%B', branch], check=True)
+    fields = log.decode('utf8', 'surrogateescape').split('\0')
+    history = []
+    for fidx in range(0, len(fields) - 1, 2):
+        message = fields[fidx+1]
+        if message.startswith(squash):
+            message = squash
+        history.append((fields[fidx], message))
+    return history
+
+def check_engines(benchmark_desc_file, relative_gfr_path, engines=ENGINES):
+    '''
+    Build a benchmark with each of the engines, in temporary directories, and
+    compare the trees and messages of their commits with those of the first
+    engine. Prints the first commit index at which each engine differs.
+
+    Returns True if every engine built the same benchmark.
+    '''
+    cwd = os.getcwd()
+    benchmark_desc_file = os.path.abspath(benchmark_desc_file)
+    gfr_path = os.path.abspath(relative_gfr_path)
+    histories = []
+    for engine in engines:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                cbb = ChronbenchBenchmark(benchmark_desc_file, gfr_path, engine=engine)
+                cbb.build_benchmark()
+                histories.append(_benchmark_history(cbb.name, cbb.branch))
+            finally:
+                os.chdir(cwd)
+
+    same = True
+    for engine, history in zip(engines[1:], histories[1:]):
+        reference = histories[0]
+        diff = [cidx for cidx in range(min(len(history), len(reference)))
+                if history[cidx] != reference[cidx]]
+        if len(history) != len(reference):
+            print(engine+': '+str(len(history))+' commits, '+engines[0]+': '+str(len(reference)))
+            same = False
+        elif len(diff) > 0:
+            print(engine+': differs from '+engines[0]+' at commit index '+str(diff[0]))
+            same = False
+        else:
+            print(engine+': same as '+engines[0]+' ('+str(len(history))+' commits)')
+    return same
+
 def main():
     parser = argparse.ArgumentParser(
         prog='build_benchmark.py',
@@ -344,14 +1174,42 @@ def main():
     benchmarks = get_available_benchmarks('benchmarks')
     benchmark_names = benchmarks.keys()
 
-    parser.add_argument('benchmark_name', choices=benchmark_names, help='build the named benchmark')
+    parser.add_argument('benchmark_name', choices=benchmark_names, nargs='?', help='build the named benchmark')
+    parser.add_argument('-a', '--all', action='store_true', help='build every available benchmark')
+    parser.add_argument('-j', type=int, default=1, help='max number of benchmarks to build in parallel with --all')
     parser.add_argument('-c', '--clean', action='store_true', help='cleanup the named benchmark')
     parser.add_argument('-s', '--stats', action='store_true', help='write statistics file')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='filter-repo',
+                        help='history rewriting engine (default: filter-repo)')
+    parser.add_argument('-m', '--mirror-cache', metavar='DIR',
+                        help='clone upstream repositories from bare mirrors kept in DIR')
+    parser.add_argument('-b', '--build-cache', metavar='DIR',
+                        help='restore unchanged benchmarks from (and store new builds in) DIR')
+    parser.add_argument('--check-engines', action='store_true',
+                        help='build the named benchmark with every engine and compare the results')
 
     args = parser.parse_args()
+    if args.all == (args.benchmark_name is not None):
+        parser.error('give exactly one of benchmark_name or --all')
+    if args.check_engines and (args.all or args.clean):
+        parser.error('--check-engines builds a single benchmark')
+
+    if args.check_engines:
+        success = check_engines(benchmarks[args.benchmark_name], 'git-filter-repo')
+        sys.exit(0 if success else 1)
+
+    options = {
+        'stats': args.stats,
+        'engine': args.engine,
+        'mirror_cache': args.mirror_cache,
+        'build_cache': args.build_cache,
+    }
+
+    if args.all:
+        success = build_suite(benchmarks, args.j, args.clean, **options)
+        sys.exit(0 if success else 1)
 
-    cbb = ChronbenchBenchmark(benchmarks[args.benchmark_name], 'git-filter-repo',
-                              stats = args.stats)
+    cbb = ChronbenchBenchmark(benchmarks[args.benchmark_name], 'git-filter-repo', **options)
     if args.clean:
         cbb.cleanup_benchmark()
     else:
@@ -0,0 +1,207 @@
+import os
+import subprocess
+
+class GitError(Exception):
+    '''
+    A git command failed. The message includes git's stderr.
+    '''
+    pass
+
+class GitRepo:
+    '''
+    Run git commands in a repository.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._objects = None
+
+    def _split(self, cmd):
+        '''
+        If cmd is a string split it on spaces. If it is a list leave it as is.
+        '''
+        if type(cmd) is not list:
+            cmd = cmd.split()
+        return cmd
+
+    def run(self, cmd, check=False):
+        '''
+        Run a command in the repository and wait for it to finish.
+
+        Returns stdout as a list of utf8 strings. If check is True raise a
+        GitError if the command fails.
+        '''
+        return self.run_bytes(cmd, check=check).decode('utf8').split('\n')
+
+    def run_bytes(self, cmd, input=None, env=None, check=False):
+        '''
+        Run a command in the repository, optionally feeding it input (bytes)
+        and with a custom environment.
+
+        Returns stdout as bytes. If check is True raise a GitError if the
+        command fails.
+        '''
+        cmd = self._split(cmd)
+        result = subprocess.run(cmd, cwd=self.path, capture_output=True, input=input, env=env)
+        if check and result.returncode != 0:
+            raise GitError(' '.join(cmd)+' failed in '+self.path+': '
+                           +result.stderr.decode('utf8', 'replace').strip())
+        return result.stdout
+
+    def stream(self, cmd, check=True):
+        '''
+        Run a command in the repository and yield stdout one utf8 line at a
+        time as it is produced, without holding all of it in memory.
+
+        If check is True raise a GitError once the output is exhausted if the
+        command failed.
+        '''
+        cmd = self._split(cmd)
+        proc = subprocess.Popen(cmd, cwd=self.path, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        with proc.stdout:
+            for line in proc.stdout:
+                yield line.decode('utf8', 'replace').rstrip('\n')
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+        if check and proc.returncode != 0:
+            raise GitError(' '.join(cmd)+' failed in '+self.path+': '
+                           +stderr.decode('utf8', 'replace').strip())
+
+    @property
+    def objects(self):
+        '''
+        A long-lived GitObjectReader for this repository
+        '''
+        if self._objects is None:
+            self._objects = GitObjectReader(self.path)
+        return self._objects
+
+    def close(self):
+        '''
+        Stop any long-lived git processes
+        '''
+        if self._objects is not None:
+            self._objects.close()
+            self._objects = None
+
+class GitObjectReader:
+    '''
+    Look up objects and revisions through persistent `git cat-file --batch`
+    and `git cat-file --batch-check` processes, instead of starting a new git
+    process per lookup.
+
+    Processes are started on first use. A process that forks (e.g. a
+    multiprocessing worker) gets its own cat-file processes rather than
+    sharing its parent's pipes.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._pid = None
+        self._batch = None
+        self._batch_check = None
+
+    def _start(self, mode):
+        return subprocess.Popen(['git', 'cat-file', mode], cwd=self.path,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _procs(self):
+        '''
+        Return the (batch, batch-check) processes, starting them if needed
+        '''
+        if self._pid != os.getpid():
+            # inherited from a parent process, do not touch its pipes
+            self._batch = None
+            self._batch_check = None
+            self._pid = os.getpid()
+        if self._batch is None:
+            self._batch = self._start('--batch')
+            self._batch_check = self._start('--batch-check')
+        return (self._batch, self._batch_check)
+
+    def _request(self, proc, rev):
+        '''
+        Send one revision to a cat-file process and read the header line.
+
+        Returns the header split on spaces, or None if rev does not exist.
+        '''
+        if '\n' in rev:
+            raise ValueError('revision contains a newline: '+repr(rev))
+        proc.stdin.write(rev.encode('utf8')+b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if len(header) == 0:
+            raise GitError('git cat-file exited unexpectedly in '+self.path)
+        header = header.decode('utf8').split()
+        if header[-1] in ['missing', 'ambiguous']:
+            return None
+        return header
+
+    def info(self, rev):
+        '''
+        Returns (<sha>, <type>, <size>) of the object named by rev, or None
+        if it does not exist. rev can be any revision, e.g. HEAD~3 or
+        <sha>^{tree}.
+        '''
+        header = self._request(self._procs()[1], rev)
+        if header is None:
+            return None
+        return (header[0], header[1], int(header[2]))
+
+    def rev_parse(self, rev):
+        '''
+        Returns the sha of the object named by rev, or None if it does not exist
+        '''
+        info = self.info(rev)
+        if info is None:
+            return None
+        return info[0]
+
+    def read(self, rev):
+        '''
+        Returns (<sha>, <type>, <contents as bytes>) of the object named by
+        rev, or None if it does not exist.
+        '''
+        batch = self._procs()[0]
+        header = self._request(batch, rev)
+        if header is None:
+            return None
+        size = int(header[2])
+        contents = batch.stdout.read(size)
+        # each object is followed by a newline
+        batch.stdout.read(1)
+        return (header[0], header[1], contents)
+
+    def commit(self, rev):
+        '''
+        Read and parse a commit object.
+
+        Returns a dictionary formatted as:
+            {'sha': <sha>, 'tree': <tree sha>, 'parents': [<sha>, ...],
+             'author': <raw ident>, 'committer': <raw ident>, 'message': <str>}
+        or None if rev does not name a commit.
+        '''
+        obj = self.read(rev+'^{commit}')
+        if obj is None:
+            return None
+        header, _, message = obj[2].partition(b'\n\n')
+        commit = {'sha': obj[0], 'parents': [], 'message': message.decode('utf8', 'surrogateescape')}
+        for line in header.decode('utf8', 'surrogateescape').split('\n'):
+            field, _, value = line.partition(' ')
+            if field == 'parent':
+                commit['parents'].append(value)
+            elif field in ['tree', 'author', 'committer']:
+                commit[field] = value
+        return commit
+
+    def close(self):
+        '''
+        Stop the cat-file processes
+        '''
+        if self._pid == os.getpid():
+            for proc in [self._batch, self._batch_check]:
+                if proc is not None:
+                    proc.stdin.close()
+                    proc.wait()
+        self._batch = None
+        self._batch_check = None
@@ -4,9 +4,23 @@ import argparse
 import math
 import shutil
 import multiprocessing
+import subprocess
+import tarfile
+import tempfile
+import concurrent.futures
+import collections
+import queue
+import traceback
+import socket
+import threading
+import time
 
 from tool_automation import Vivado
 from tool_automation import Quartus
+from resource_monitor import pin_cpus
+from results_store import ResultsStore
+from job_server import JobServer, request, send_heartbeats, parse_address, poll_interval
+from tool_session import close_sessions
 
 sys.path.insert(1, os.path.join('..'))
 from build_benchmark import get_available_benchmarks
@@ -17,11 +31,15 @@ class SetupCharacterizationProjects:
     Create a directory structure that flattens the time dimension of a
     Chronbench benchmark.
     '''
-    def __init__(self, benchmark, tool):
+    def __init__(self, benchmark, tool, workers=1):
         self.cbb = ChronbenchBenchmark(benchmark, None)
         self.char_dir = os.path.join('util', self.cbb.name+'_'+tool+'_char_projects')
+        # database of the results of every commit, see ResultsStore
+        self.results_db = os.path.join(self.char_dir, 'results.db')
+        # max number of commit directories to set up in parallel
+        self.workers = workers
 
-    def build_directory_structure(self):
+    def build_directory_structure(self, lazy=False):
             '''
             Create a directory structure suitable for building many benchmark
             commits in parallel.
@@ -39,63 +57,117 @@ class SetupCharacterizationProjects:
                     src/
                         <all source files from <benchmark>@<sha>>
 
+            Directories are (re)used if they all ready exist, and commits whose
+            `src` directory is missing (e.g. an interrupted setup) are
+            completed. With lazy=True no sources are written here at all;
+            instead materialize() must be called on a commit directory before
+            it is used (RunFPGATool does this when given the setup object).
+
             Returns a tuple of the current benchmark and a list of all of the
             commit level directories.
             '''
-            # create the main directory
-            try:
-                self._create_char_dir()
-            except FileExistsError:
+            # without the benchmark repository all we can do is use what exists
+            if not os.path.isdir(self.cbb.name):
                 projects = self._enumerate_existing_projects()
                 print('Found '+str(len(projects))+' commit directories')
-            else:
-                # get a list of all available commits in the current benchmark
-                self.cbb._run_cmd('git checkout '+self.cbb.branch)
-                available_commits = self.cbb._run_cmd('git log --format=format:%H')
-
-                # figure out the number of commits to synthesize
-                depth = len(available_commits)
-                print('Building '+str(depth)+' commit directories')
-
-                # figure out how many digits to use in the prefix
-                prefix_digits = math.ceil(math.log(depth, 10))
-                prefix_str = "{:0"+str(prefix_digits)+"d}"
-
-                # starting at the most recent commit set up <depth> projects
-                projects = []
-                for cidx in range(depth):
-                    prefix = prefix_str.format(cidx)
-                    commit_dir = self._initialize_commit_dir(prefix, available_commits[cidx])
-                    projects.append(commit_dir)
-            finally:
                 self.char_proj = (self.cbb, projects)
                 return self.char_proj
 
-    def _create_char_dir(self):
+            # create the main directory
+            os.makedirs(self.char_dir, exist_ok=True)
+
+            # get a list of all available commits in the current benchmark
+            available_commits = self.cbb._run_cmd('git rev-list '+self.cbb.branch, check=True)[:-1]
+
+            # figure out the number of commits to synthesize
+            depth = len(available_commits)
+
+            # figure out how many digits to use in the prefix
+            prefix_digits = math.ceil(math.log(depth, 10))
+            prefix_str = "{:0"+str(prefix_digits)+"d}"
+
+            # starting at the most recent commit there are <depth> projects
+            projects = []
+            for cidx in range(depth):
+                prefix = prefix_str.format(cidx)
+                projects.append(os.path.join(self.char_dir, prefix+'_'+available_commits[cidx]))
+
+            missing = [p for p in projects if not self._is_materialized(p)]
+            if lazy:
+                print('Found '+str(depth - len(missing))+' of '+str(depth)+' commit directories, '
+                      +'the rest are built on demand')
+            elif len(missing) > 0:
+                print('Building '+str(len(missing))+' of '+str(depth)+' commit directories')
+                # Sources come straight from the object database, so the
+                # projects can be set up in parallel
+                with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                    list(pool.map(self.materialize, missing))
+            else:
+                print('Found '+str(depth)+' commit directories')
+
+            self.char_proj = (self.cbb, projects)
+            return self.char_proj
+
+    def _is_materialized(self, commit_dir):
         '''
-        Create a directory to hold commit-level characterization projects.
+        A commit directory is complete once its `src` directory exists, since
+        materialize() only ever creates it with a rename.
         '''
-        if not os.path.isdir(self.char_dir):
-            os.makedirs(self.char_dir)
-        else:
-            raise FileExistsError
+        return os.path.isdir(os.path.join(commit_dir, 'src'))
 
-    def _initialize_commit_dir(self, prefix, sha):
+    def materialize(self, commit_dir):
         '''
-        Create a commit-level project directory, in the experiment directory.
-        Then checkout the benchmark at the corresponding commit and copy all
-        the sources into a `src` directory in the commit-level directory.
+        Make sure the commit-level project directory commit_dir (named
+        <prefix>_<sha>) exists and has all the sources of the benchmark at
+        <sha> in its `src` directory.
 
-        Returns the path to the commit-level directory
-        '''
-        commit_dir = os.path.join(self.char_dir, prefix+'_'+sha)
-        os.makedirs(commit_dir)
+        Idempotent, and safe to call concurrently from several threads or
+        processes: sources are written to a private temporary directory that
+        is then renamed to `src`. If another caller wins the race its `src`
+        is kept.
 
-        self.cbb._run_cmd('git checkout '+sha)
-        shutil.copytree(self.cbb.name, os.path.join(commit_dir, 'src'), ignore=shutil.ignore_patterns('.git*'))
+        Returns commit_dir
+        '''
+        if self._is_materialized(commit_dir):
+            return commit_dir
+
+        sha = os.path.basename(commit_dir).split('_', 1)[1]
+        os.makedirs(commit_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='src.', dir=commit_dir)
+        try:
+            self._export_sources(sha, tmp)
+            os.rename(tmp, os.path.join(commit_dir, 'src'))
+        except OSError:
+            # lost the race, an identical src all ready exists
+            if not self._is_materialized(commit_dir):
+                raise
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
 
         return commit_dir
 
+    def _export_sources(self, sha, dest):
+        '''
+        Write the tree of commit <sha> into the directory dest using
+        `git archive`, without checking anything out in the benchmark
+        repository. Like the checkout this replaces, git metadata files
+        (.git*) are left out.
+        '''
+        archive = subprocess.Popen(['git', 'archive', '--format=tar', sha],
+                                   cwd=self.cbb.name, stdout=subprocess.PIPE)
+        with tarfile.open(fileobj=archive.stdout, mode='r|') as tar:
+            for member in tar:
+                if member.name.split('/')[0].startswith('.git'):
+                    continue
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extract(member, dest, filter='data')
+                else:
+                    tar.extract(member, dest)
+        archive.stdout.close()
+        if archive.wait() != 0:
+            raise RuntimeError('git archive '+sha+' failed in '+self.cbb.name)
+
     def _enumerate_existing_projects(self):
         '''
         Get a list of all of the subdirectories in the char project directory.
@@ -111,73 +183,489 @@ class RunFPGATool:
     '''
     Run Synthesis and/or PnR on a characterization project
     '''
-    def __init__(self, tool, char_proj, workers=1):
+    def __init__(self, tool, char_proj, workers=1, setup=None, longest_first=False, tool_options={},
+                 warm_start=False, mem_budget=None, cpu_alloc=False):
         self.tool = tool
         self.cbb = char_proj[0]
         self.projects = char_proj[1]
         self.workers = workers
-        self._distribute_work()
+        # if given, a SetupCharacterizationProjects used to materialize each
+        # commit directory just before it is first used
+        self.setup = setup
+        # if True order the job queue by expected runtime, longest first
+        self.longest_first = longest_first
+        # if True seed each commit's Tmin search from the nearest commit that
+        # all ready has a result
+        self.warm_start = warm_start
+        # if given, the memory (in bytes) that running jobs may use together.
+        # jobs are only started when their expected peak memory fits
+        self.mem_budget = mem_budget
+        # if True split the CPUs among the running jobs: each job is pinned to
+        # its CPUs, and the tool uses one thread per CPU
+        self.cpu_alloc = cpu_alloc
+        if cpu_alloc:
+            self.cpus = sorted(os.sched_getaffinity(0))
+        else:
+            # CPU affinity is not available on every platform
+            self.cpus = list(range(os.cpu_count()))
+        # extra keyword arguments for each tool object, e.g. the Tmin search
+        # strategy
+        self.tools = [self.tool(p, self.cbb, **tool_options) for p in self.projects]
 
-    def _distribute_work(self):
+    def _expected_runtimes(self, step):
         '''
-        Create a job queue for each worker
+        Estimate the runtime of <step> for each project from the elapsed
+        times recorded in <tool>_<step>.[PASS|FAIL] files by earlier runs.
+        Projects that all ready have a result will be skipped, so cost
+        nothing. Otherwise use the recorded time of the nearest commit (nearby
+        commits are usually similar), falling back to the project's own
+        synthesis time, and finally 0.
+
+        Returns a list of runtimes in seconds, in the same order as projects.
         '''
-        projects = []
-        for p in self.projects:
-            projects.append(self.tool(p, self.cbb))
+        recorded = [t.read_result(step) for t in self.tools]
+        nearest = self._nearest_recorded([r[1] if r is not None else None for r in recorded])
+
+        expected = []
+        for idx in range(len(recorded)):
+            if recorded[idx] is not None:
+                expected.append(0.0)
+            elif nearest[idx] is not None:
+                expected.append(nearest[idx])
+            else:
+                synth = self.tools[idx].read_result('synth')
+                expected.append(synth[1] if synth is not None else 0.0)
+        return expected
+
+    def _nearest_recorded(self, values):
+        '''
+        For each project, find the value recorded for the nearest project
+        (itself included) in <values>, a list with None for projects that have
+        no recorded value.
+
+        Returns a list of values, None where no project has one.
+        '''
+        n = len(values)
+        # distance to, and value of, the nearest recorded neighbour
+        nearest = [(n, None)] * n
+        for indices in [range(n), reversed(range(n))]:
+            last = None
+            for idx in indices:
+                if values[idx] is not None:
+                    last = idx
+                if last is not None and abs(idx - last) < nearest[idx][0]:
+                    nearest[idx] = (abs(idx - last), values[last])
+        return [value for _, value in nearest]
+
+    def _recorded_peaks(self, step):
+        '''
+        Returns the peak memory use recorded for <step> of each project, None
+        where it was not recorded
+        '''
+        return [t.read_result_stats(step).get('peak_rss') for t in self.tools]
+
+    def _expected_peak(self, peaks, idx, step):
+        '''
+        Estimate the peak memory use of <step> for project <idx> from
+        <peaks>, the recorded peaks of each step (see _recorded_peaks()).
+        Projects that all ready have a result will be skipped, so use
+        nothing. Otherwise use the peak of the nearest commit, falling back
+        to the largest peak of any commit for any step.
+
+        Returns the expected peak in bytes, or None if nothing is known yet.
+        '''
+        if self.tools[idx].read_result(step) is not None:
+            return 0
+        nearest = self._nearest_recorded(peaks[step])[idx]
+        if nearest is not None:
+            return nearest
+        known = [peak for step_peaks in peaks.values() for peak in step_peaks if peak is not None]
+        if len(known) > 0:
+            return max(known)
+        return None
+
+    def _admit(self, expected, reserved, running):
+        '''
+        Returns True if a job expected to use <expected> bytes (None if
+        unknown) can start while running jobs have <reserved> bytes reserved.
+        A job of unknown size only starts alone, and one job can always run.
+        '''
+        if self.mem_budget is None or running == 0:
+            return True
+        if expected is None:
+            return False
+        return reserved + expected <= self.mem_budget
+
+    def _allocate_cpus(self, load, jobs):
+        '''
+        Choose the CPUs for a job, given the number of jobs that share <load>
+        ({<cpu>: <number of running jobs pinned to it>}). Each job gets an
+        equal share of the CPUs, so when fewer jobs than workers are left
+        (i.e. the queue drains) each gets more. The least loaded CPUs are
+        chosen, and <load> is updated.
+
+        Returns the list of CPUs
+        '''
+        share = max(1, len(self.cpus)//max(1, min(self.workers, jobs)))
+        cpus = sorted(self.cpus, key=lambda cpu: load[cpu])[:share]
+        for cpu in cpus:
+            load[cpu] = load[cpu] + 1
+        return cpus
 
-        # distribute projects amongst workers to form jobs
-        jobs = [ [] for _ in range(self.workers)]
-        while len(projects) > 0:
-            for w in range(self.workers):
-                try:
-                    jobs[w].append(projects.pop())
-                except:
-                    pass
-        self.jobs = jobs
+    def _job_order(self, step):
+        '''
+        Returns project indices in the order to run <step>: oldest commit
+        first, or by expected runtime (longest first) if longest_first is set.
+        '''
+        order = list(reversed(range(len(self.tools))))
+        if self.longest_first:
+            expected = self._expected_runtimes(step)
+            order.sort(key=lambda idx: -expected[idx])
+        return order
 
-    def _start_workers(self, worker):
+    def _build_queue(self, step):
+        '''
+        Create a job queue of project indices shared by all workers. Workers
+        pull the next job as soon as they finish one, so no worker sits idle
+        while there is work left. The queue ends with one None per worker.
         '''
-        Launch a worker for each job
+        queue = multiprocessing.Queue()
+        for idx in self._job_order(step):
+            queue.put(idx)
+        for _ in range(self.workers):
+            queue.put(None)
+        return queue
+
+    def _start_workers(self, worker, step):
         '''
+        Launch the workers, which share a queue of jobs for <step>
+        '''
+        queue = self._build_queue(step)
         procs = []
-        for j in self.jobs:
-            proc = multiprocessing.Process(target=worker, args=(self, j))
+        for _ in range(self.workers):
+            proc = multiprocessing.Process(target=worker, args=(self, queue))
             proc.start()
             procs.append(proc)
         return procs
 
+    def _materialize(self, project):
+        '''
+        Write the sources of a project's commit, if that is done on demand
+        '''
+        if self.setup is not None:
+            self.setup.materialize(project.proj_dir)
+
+    def _nearest_tmin_bracket(self, idx):
+        '''
+        Returns the Tmin bracket (see AbstractFPGATool.read_tmin_bracket) of
+        the nearest commit to project <idx> that has finished its Tmin
+        search, or None if there is none yet.
+        '''
+        for distance in range(1, len(self.tools)):
+            for neighbour in [idx - distance, idx + distance]:
+                if neighbour < 0 or neighbour >= len(self.tools):
+                    continue
+                bracket = self.tools[neighbour].read_tmin_bracket()
+                if bracket is not None and None not in bracket:
+                    return bracket
+        return None
+
+    def _run_pnr(self, idx):
+        '''
+        Place and route project <idx>, warm starting its Tmin search if
+        requested
+        '''
+        project = self.tools[idx]
+        if self.warm_start:
+            project.warm_start(self._nearest_tmin_bracket(idx))
+        project.run_pnr()
+
     def synthesis(self):
         '''
         Start synthesis workers
         '''
         print('Starting Synthesis')
-        procs = self._start_workers(RunFPGATool._synth_worker)
+        if self.mem_budget is not None or self.cpu_alloc:
+            self._dispatch(collections.deque([(idx, 'synth') for idx in self._job_order('synth')]))
+            return
+        procs = self._start_workers(RunFPGATool._synth_worker, 'synth')
         for p in procs:
             p.join()
 
-    def _synth_worker(self, job):
+    def _synth_worker(self, queue):
         '''
-        Run synthesis for all projects in a job
+        Run synthesis for projects from the queue until it is empty
         '''
-        for project in job:
+        for idx in iter(queue.get, None):
+            project = self.tools[idx]
+            self._materialize(project)
             project.run_synthesis()
+        close_sessions()
+
+    def pipeline(self):
+        '''
+        Run synthesis and place and route as a pipeline. Synthesis and PnR
+        jobs share the same worker slots, and a commit's PnR is queued as soon
+        as its synthesis passes (ahead of the remaining synthesis jobs, so
+        the first Fmax results arrive early). Commits that fail synthesis are
+        not placed and routed.
+        '''
+        print('Starting Synthesis and Place and Route')
+        self._dispatch(collections.deque([(idx, 'synth') for idx in self._job_order('synth')]),
+                       pipeline=True)
+
+    def _dispatch(self, ready, pipeline=False):
+        '''
+        Run the (<project index>, <step>) jobs in <ready> on the workers, in
+        order. If <pipeline> is set a commit's PnR is queued as soon as its
+        synthesis passes.
+
+        With a memory budget a job only starts once its expected peak memory
+        fits next to the running jobs, so small designs run many at a time and
+        large ones few. Estimates come from earlier runs, and are updated as
+        jobs finish.
+
+        With CPU allocation each job is pinned to its share of the CPUs (see
+        _allocate_cpus()).
+
+        A job whose worker dies (e.g. it is killed for running out of memory)
+        fails, and the worker is replaced.
+        '''
+        results = multiprocessing.Queue()
+        # (<process>, <task queue>) of each worker
+        workers = [self._start_pipeline_worker(results) for _ in range(self.workers)]
+        # the job each worker is running, by worker index
+        busy = {}
+
+        load = {cpu: 0 for cpu in self.cpus}
+        peaks = None
+        if self.mem_budget is not None:
+            peaks = {'synth': self._recorded_peaks('synth'), 'pnr': self._recorded_peaks('pnr')}
+
+        # jobs are only handed out when a worker slot is free (and the memory
+        # budget allows), so that the order of `ready` is the order jobs
+        # start in
+        running = {}
+        allocated = {}
+        while len(ready) > 0 or len(running) > 0:
+            while len(ready) > 0 and len(running) < self.workers:
+                idx, step = ready[0]
+                expected = 0
+                if peaks is not None:
+                    expected = self._expected_peak(peaks, idx, step)
+                if not self._admit(expected, sum(running.values()), len(running)):
+                    break
+                # a job of unknown size runs alone, so reserve the budget
+                running[ready.popleft()] = expected if expected is not None else self.mem_budget
+                cpus = None
+                if self.cpu_alloc:
+                    # in a pipeline each commit still to synthesize is a PnR job to come
+                    jobs = len(running) + len(ready)
+                    if pipeline:
+                        jobs = jobs + sum([1 for _, s in ready if s == 'synth'])
+                    cpus = self._allocate_cpus(load, jobs)
+                    allocated[(idx, step)] = cpus
+                widx = [w for w in range(len(workers)) if w not in busy][0]
+                busy[widx] = (idx, step)
+                workers[widx][1].put((idx, step, cpus))
+            try:
+                idx, step, success = results.get(timeout=poll_interval)
+                widx = [w for w, job in busy.items() if job == (idx, step)][0]
+            except queue.Empty:
+                dead = [w for w in busy.keys() if not workers[w][0].is_alive()]
+                if len(dead) == 0:
+                    continue
+                widx = dead[0]
+                idx, step = busy[widx]
+                success = False
+                print('WARNING: the worker running '+step+' of '+self.projects[idx]+' died (exit code '
+                      +str(workers[widx][0].exitcode)+'), skipping it')
+                workers[widx] = self._start_pipeline_worker(results)
+            del busy[widx]
+            del running[(idx, step)]
+            for cpu in allocated.pop((idx, step), []):
+                load[cpu] = load[cpu] - 1
+            if peaks is not None:
+                peaks[step][idx] = self.tools[idx].read_result_stats(step).get('peak_rss')
+            if pipeline and step == 'synth':
+                if success:
+                    ready.appendleft((idx, 'pnr'))
+                else:
+                    print(self.projects[idx]+': synthesis failed, skipping pnr')
+
+        for _, tasks in workers:
+            tasks.put(None)
+        for proc, _ in workers:
+            proc.join()
+
+    def _start_pipeline_worker(self, results):
+        '''
+        Start a worker for _dispatch(), with its own queue of tasks so the job
+        it runs is known if it dies.
+
+        Returns a tuple of (<process>, <task queue>)
+        '''
+        tasks = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=RunFPGATool._pipeline_worker, args=(self, tasks, results))
+        proc.start()
+        return (proc, tasks)
 
-    def pnr(self):
+    def incremental(self, pnr=True):
         '''
-        Start place and route workers
+        Run the incremental flow. Each commit is synthesized (and placed and
+        routed if <pnr>) starting from the results of the previous commit,
+        so commits are run one at a time, oldest first. Commits that fail
+        synthesis are skipped, and the next commit starts from the last
+        commit that passed.
+
+        Finally compare the runtimes to the from scratch flow, for commits
+        that have results for both.
         '''
-        print('Starting Place and Route')
-        procs = self._start_workers(RunFPGATool._pnr_worker)
+        print('Starting Incremental Synthesis'+(' and Place and Route' if pnr else ''))
+        if self.cpu_alloc:
+            # one job at a time, so it gets every CPU
+            for project in self.tools:
+                project.threads = len(self.cpus)
+        reference = None
+        for idx in reversed(range(len(self.tools))):
+            project = self.tools[idx]
+            project.reference = reference
+            self._materialize(project)
+            if not project.run_synthesis():
+                print(self.projects[idx]+': synthesis failed, skipping')
+                continue
+            if pnr:
+                self._run_pnr(idx)
+            reference = project
+        close_sessions()
+
+        for step in ['synth', 'pnr'] if pnr else ['synth']:
+            scratch_total = 0
+            incremental_total = 0
+            count = 0
+            for project in self.tools:
+                scratch = project.read_result(step)
+                incremental = project.read_result(step+'_incr')
+                if scratch is not None and incremental is not None:
+                    scratch_total = scratch_total + scratch[1]
+                    incremental_total = incremental_total + incremental[1]
+                    count = count + 1
+            if count > 0:
+                print(step+': '+str(count)+' commits, from scratch '+str(scratch_total)+'s, incremental '
+                      +str(incremental_total)+'s ('+str(round(scratch_total/max(incremental_total, 1e-9), 2))+'x)')
+
+    def _pipeline_worker(self, tasks, results):
+        '''
+        Run (<project index>, <step>, <cpus>) jobs from tasks until a None is
+        received. If <cpus> is not None the job is pinned to those CPUs and
+        runs the tool with as many threads.
+        Report (<project index>, <step>, <success>) to results after each job.
+        '''
+        for idx, step, cpus in iter(tasks.get, None):
+            success = False
+            try:
+                if cpus is not None:
+                    pin_cpus(cpus)
+                    self.tools[idx].threads = len(cpus)
+                success = self._run_job(idx, step)
+            finally:
+                results.put((idx, step, success))
+        close_sessions()
+
+    def _run_job(self, idx, step):
+        '''
+        Run <step> ('synth' or 'pnr') of project <idx>.
+
+        Returns True if it succeeded
+        '''
+        project = self.tools[idx]
+        try:
+            self._materialize(project)
+            if step == 'synth':
+                return project.run_synthesis()
+            self._run_pnr(idx)
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+
+    def serve(self, address, pipeline=True, lease_ttl=120):
+        '''
+        Coordinate a sweep run by workers on other hosts (see connect()) that
+        share the characterization directory. Synthesis jobs, and PnR jobs
+        once synthesis passes if <pipeline> is set, are handed out by a
+        JobServer listening on <address>, a (<host>, <port>) tuple. Jobs of
+        workers that stop sending heartbeats for <lease_ttl> seconds are
+        handed out again.
+
+        Results are recorded in the results store here, as workers report
+        them, so only this host writes to the database.
+        '''
+        names = [os.path.basename(os.path.normpath(p)) for p in self.projects]
+
+        def on_complete(job, success):
+            idx = names.index(job[0])
+            project = self.tools[idx]
+            project.record_in_store(project.synth_step if job[1] == 'synth' else project.pnr_step)
+            if pipeline and job[1] == 'synth':
+                if success:
+                    return [[job[0], 'pnr']]
+                print(self.projects[idx]+': synthesis failed, skipping pnr')
+            return []
+
+        jobs = [[names[idx], 'synth'] for idx in self._job_order('synth')]
+        server = JobServer(address, jobs, on_complete, lease_ttl)
+        print('Serving '+str(len(jobs))+' commits on '+server.address[0]+':'+str(server.address[1]))
+        server.serve()
+
+    def connect(self, address):
+        '''
+        Start workers that run jobs from the job server at <address> (see
+        serve()) until it has none left
+        '''
+        print('Starting '+str(self.workers)+' workers for '+address[0]+':'+str(address[1]))
+        procs = []
+        for _ in range(self.workers):
+            proc = multiprocessing.Process(target=RunFPGATool._remote_worker, args=(self, address))
+            proc.start()
+            procs.append(proc)
         for p in procs:
             p.join()
 
-    def _pnr_worker(self, job):
+    def _remote_worker(self, address, retries=12):
         '''
-        Run place and route for all projects in a job
+        Lease jobs from the job server at <address> and run them, sending
+        heartbeats while they run. Gives up if the server can not be reached
+        <retries> times in a row.
         '''
-        for project in job:
-            project.run_pnr()
+        worker = socket.gethostname()+':'+str(os.getpid())
+        names = [os.path.basename(os.path.normpath(p)) for p in self.projects]
+        failures = 0
+        while failures < retries:
+            try:
+                reply = request(address, {'op': 'lease', 'worker': worker})
+            except OSError:
+                failures = failures + 1
+                time.sleep(poll_interval)
+                continue
+            failures = 0
+            if 'done' in reply:
+                break
+            if 'wait' in reply:
+                time.sleep(reply['wait'])
+                continue
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=send_heartbeats,
+                                         args=(address, reply['lease'], reply['ttl'], stop), daemon=True)
+            heartbeat.start()
+            success = self._run_job(names.index(reply['job'][0]), reply['job'][1])
+            stop.set()
+            heartbeat.join()
+            try:
+                request(address, {'op': 'complete', 'lease': reply['lease'], 'success': success})
+            except OSError:
+                print('WARNING: could not report '+' '.join(reply['job'])+' to the job server')
+        close_sessions()
 
 def main():
     os.chdir('..')
@@ -200,19 +688,104 @@ def main():
     parser.add_argument('tool', choices=tools.keys(), help='FPGA tool to use')
     parser.add_argument('step', choices=steps, help='FPGA flow steps to use. steps automatically run dependancies.')
     parser.add_argument('benchmark_name', choices=benchmark_names, help='benchmark to operate on')
-    parser.add_argument('-j', type=int, help='max number of synthesis jobs to run', default=1)
+    parser.add_argument('-j', type=int, help='max number of parallel jobs (commit setup, synthesis, place and route). default 1, or the number of CPUs with --mem-budget')
+    parser.add_argument('--lazy', action='store_true', help='set up each commit directory just before it is synthesized')
+    parser.add_argument('--ljf', action='store_true', help='run the jobs expected to take longest first, based on earlier runs')
+    parser.add_argument('--fmax-search', choices=['binary', 'kary', 'slack', 'intool'], default='binary',
+                        help='Tmin search: one place and route at a time (binary), --fmax-k speculative runs at once per commit (kary), guided by the reported slack (slack), or a binary search run inside a single tool run (intool, vivado only)')
+    parser.add_argument('--fmax-k', type=int, default=4, help='number of concurrent place and route runs per commit for --fmax-search kary')
+    parser.add_argument('--fmax-tol', type=float, default=0.01, help='stop the Tmin search once it is bracketed to within this many ns')
+    parser.add_argument('--fmax-rtol', type=float, default=0.005, help='stop the Tmin search once it is bracketed to within this fraction of the period')
+    parser.add_argument('--fmax-max-runs', type=int, help='max number of place and route runs (rounds for kary) per Tmin search')
+    parser.add_argument('--tool-session', action='store_true',
+                        help='keep one tool process open per worker and run every script in it, instead of starting the tool for each run (vivado only)')
+    parser.add_argument('--session-timeout', type=float, default=3600, metavar='SECONDS',
+                        help='with --tool-session, restart a tool session that prints nothing for this many seconds (0 to wait forever)')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='reuse synthesis and place and route results from DIR for commits with identical sources and settings, and store new ones there')
+    parser.add_argument('--flow', choices=['scratch', 'incremental'], default='scratch',
+                        help='compile each commit from scratch, or incrementally from the previous commit one commit at a time (vivado only). results of the two flows are kept side by side')
+    parser.add_argument('--mem-budget', type=float, metavar='GB',
+                        help='only start a job when the peak memory it is expected to use, going by earlier runs, fits in GB next to the running jobs')
+    parser.add_argument('--cpu-alloc', action='store_true',
+                        help='split the CPUs among the running jobs: pin each job to its share and let the tool use that many threads. jobs get more CPUs as the queue drains')
+    parser.add_argument('--serve', metavar='HOST:PORT',
+                        help='hand out synthesis and place and route jobs to --connect workers on other hosts that share the characterization directory')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='run -j workers that take jobs from the --serve coordinator at HOST:PORT')
+    parser.add_argument('--lease-ttl', type=float, default=120,
+                        help='with --serve, hand out a job again if its worker sends no heartbeat for this many seconds')
+    parser.add_argument('--warm-start', action='store_true', help='start each Tmin search from the result of the nearest commit that all ready has one')
 
     args = parser.parse_args()
 
+    if args.tool_session and tools[args.tool].session_cmd is None:
+        print("QUITTING: --tool-session is not supported for "+args.tool)
+        exit()
+    if args.fmax_search not in tools[args.tool].fmax_searches:
+        print("QUITTING: --fmax-search "+args.fmax_search+" is not supported for "+args.tool)
+        exit()
+    if args.flow not in tools[args.tool].flows:
+        print("QUITTING: --flow "+args.flow+" is not supported for "+args.tool)
+        exit()
+    if args.serve is not None or args.connect is not None:
+        if args.serve is not None and args.connect is not None:
+            print("QUITTING: --serve and --connect can not be used together")
+            exit()
+        if args.flow == 'incremental':
+            print("QUITTING: --flow incremental runs one commit at a time, and can not be distributed")
+            exit()
+        if args.mem_budget is not None or args.cpu_alloc:
+            print("QUITTING: --mem-budget and --cpu-alloc are not supported with --serve or --connect")
+            exit()
+    if args.cpu_alloc and not hasattr(os, 'sched_setaffinity'):
+        print("QUITTING: --cpu-alloc needs CPU affinity, which this platform does not support")
+        exit()
+    if args.flow == 'incremental' and args.fmax_search == 'intool':
+        print("QUITTING: --fmax-search intool is not supported with --flow incremental")
+        exit()
+
+    mem_budget = None
+    if args.mem_budget is not None:
+        mem_budget = int(args.mem_budget * 1024**3)
+    workers = args.j
+    if workers is None:
+        workers = os.cpu_count() if mem_budget is not None else 1
+
     benchmark = benchmarks[args.benchmark_name]
 
-    scp = SetupCharacterizationProjects(benchmark, args.tool)
-    char_proj = scp.build_directory_structure()
+    scp = SetupCharacterizationProjects(benchmark, args.tool, workers)
+    # workers leave setting up commit directories to the coordinator, and
+    # only complete the ones they run
+    lazy = (args.lazy or args.connect is not None) and args.step != 'setup'
+    char_proj = scp.build_directory_structure(lazy=lazy)
     if args.step == 'synth' or args.step =='pnr':
-        RFT = RunFPGATool(tools[args.tool], char_proj, args.j)
-        RFT.synthesis()
-        if args.step == 'pnr':
-            RFT.pnr()
+        RFT = RunFPGATool(tools[args.tool], char_proj, workers,
+                          setup=scp if lazy else None, longest_first=args.ljf,
+                          tool_options={
+                              'fmax_search': args.fmax_search,
+                              'fmax_k': args.fmax_k,
+                              'fmax_abs_tol': args.fmax_tol,
+                              'fmax_rel_tol': args.fmax_rtol,
+                              'fmax_max_runs': args.fmax_max_runs,
+                              'tool_session': args.tool_session,
+                              'session_timeout': args.session_timeout if args.session_timeout > 0 else None,
+                              'result_cache': args.result_cache,
+                              'flow': args.flow,
+                              # workers report to the coordinator, which records their results
+                              'results_store': ResultsStore(scp.results_db) if args.connect is None else None,
+                          },
+                          warm_start=args.warm_start, mem_budget=mem_budget, cpu_alloc=args.cpu_alloc)
+        if args.serve is not None:
+            RFT.serve(parse_address(args.serve), args.step == 'pnr', args.lease_ttl)
+        elif args.connect is not None:
+            RFT.connect(parse_address(args.connect))
+        elif args.flow == 'incremental':
+            RFT.incremental(args.step == 'pnr')
+        elif args.step == 'synth':
+            RFT.synthesis()
+        else:
+            RFT.pipeline()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,154 @@
+import os
+import collections
+import itertools
+import json
+import socket
+import socketserver
+import threading
+import time
+
+# how long (in seconds) a worker waits before asking again when no job can
+# be handed out yet
+poll_interval = 5
+
+def parse_address(address):
+    '''
+    Returns a (<host>, <port>) tuple from a '<host>:<port>' string
+    '''
+    host, _, port = address.rpartition(':')
+    return (host if host != '' else 'localhost', int(port))
+
+def request(address, message, timeout=30):
+    '''
+    Send <message> (a dictionary) to the job server at <address> (a (<host>,
+    <port>) tuple) and return its reply. Each request is one connection
+    carrying one line of JSON each way, so the server holds no per worker
+    connection state and workers can come and go.
+
+    Raises OSError if the server can not be reached.
+    '''
+    with socket.create_connection(address, timeout=timeout) as conn:
+        conn.sendall((json.dumps(message)+'\n').encode('utf8'))
+        reply = conn.makefile('r', encoding='utf8').readline()
+    if reply == '':
+        raise ConnectionError('no reply from job server at '+address[0]+':'+str(address[1]))
+    return json.loads(reply)
+
+def send_heartbeats(address, lease, ttl, stop):
+    '''
+    Renew <lease> with the job server at <address> every quarter of its
+    <ttl> seconds, until the event <stop> is set
+    '''
+    while not stop.wait(ttl/4):
+        try:
+            if not request(address, {'op': 'heartbeat', 'lease': lease})['ok']:
+                print('WARNING: lease '+lease+' expired, its job will be run again')
+        except OSError:
+            print('WARNING: could not reach the job server')
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            reply = self.server.jobs.handle(message)
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {'error': str(e)}
+        self.wfile.write((json.dumps(reply)+'\n').encode('utf8'))
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class JobServer:
+    '''
+    Hand out (<project>, <step>) jobs to workers over TCP, as leases.
+
+    A worker asks for a lease, sends heartbeats while it runs the job, and
+    reports completion. A lease that gets no heartbeat for lease_ttl seconds
+    (e.g. its worker or host died) expires, and its job is queued again, at
+    the front. Completions of expired leases are ignored: the job runs again,
+    and finds the result files all ready written if the worker did finish.
+
+    Requests are dictionaries with an 'op' of:
+        lease:     {'worker'} -> {'lease', 'job', 'ttl'}, or {'wait'} if no
+                   job can start yet, or {'done'} once every job is finished
+        heartbeat: {'lease'} -> {'ok'}, False if the lease expired
+        complete:  {'lease', 'success'} -> {'ok'}
+
+    <on_complete>(<job>, <success>) is called for every completed job, and
+    returns a list of jobs that can run now that it is done (e.g. PnR after
+    synthesis), which are queued at the front.
+    '''
+    def __init__(self, address, jobs, on_complete=None, lease_ttl=120):
+        self.ready = collections.deque(jobs)
+        self.on_complete = on_complete
+        self.lease_ttl = lease_ttl
+        # lease id: (<job>, <worker>, <expiry time>)
+        self.leases = {}
+        # lease ids are unique to this server, so workers of an earlier
+        # server on the same address can not complete its leases
+        self._ids = itertools.count()
+        self._prefix = os.urandom(4).hex()+'-'
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        self._server = _Server(address, _Handler)
+        self._server.jobs = self
+        self.address = self._server.server_address
+
+    def _expire(self):
+        '''
+        Requeue the jobs of expired leases. Call with the lock held.
+        '''
+        now = time.time()
+        for lease, (job, worker, expiry) in list(self.leases.items()):
+            if expiry < now:
+                print('WARNING: '+worker+' stopped responding, requeuing '+' '.join(job))
+                del self.leases[lease]
+                self.ready.appendleft(job)
+
+    def handle(self, message):
+        with self._lock:
+            self._expire()
+            op = message['op']
+            if op == 'lease':
+                if len(self.ready) > 0:
+                    job = self.ready.popleft()
+                    lease = self._prefix+str(next(self._ids))
+                    self.leases[lease] = (job, message['worker'], time.time() + self.lease_ttl)
+                    return {'lease': lease, 'job': job, 'ttl': self.lease_ttl}
+                if len(self.leases) > 0:
+                    # running jobs may still queue more (e.g. PnR)
+                    return {'wait': poll_interval}
+                self.finished.set()
+                return {'done': True}
+            elif op == 'heartbeat':
+                if message['lease'] not in self.leases:
+                    return {'ok': False}
+                job, worker, _ = self.leases[message['lease']]
+                self.leases[message['lease']] = (job, worker, time.time() + self.lease_ttl)
+                return {'ok': True}
+            elif op == 'complete':
+                if message['lease'] not in self.leases:
+                    return {'ok': False}
+                job, _, _ = self.leases.pop(message['lease'])
+                if self.on_complete is not None:
+                    for next_job in reversed(self.on_complete(job, message['success'])):
+                        self.ready.appendleft(next_job)
+                return {'ok': True}
+            raise ValueError('unknown op '+str(op))
+
+    def serve(self):
+        '''
+        Serve until every job is finished. The server stays up for a while
+        afterwards, so waiting workers are told that there is nothing left.
+        '''
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        while not self.finished.wait(poll_interval):
+            with self._lock:
+                self._expire()
+                if len(self.ready) == 0 and len(self.leases) == 0:
+                    self.finished.set()
+        time.sleep(2*poll_interval)
+        self._server.shutdown()
+        self._server.server_close()
@@ -6,6 +6,7 @@ import numpy as np
 
 from plot_qor import collect_tmin_data
 from plot_qor import collect_util_data
+from plot_qor import read_results
 from characterize_benchmark import SetupCharacterizationProjects
 sys.path.insert(1, os.path.join('..'))
 from build_benchmark import get_available_benchmarks
@@ -16,7 +17,7 @@ def get_src_stats(cbb):
     `cbb'
     '''
     cbb._run_cmd('git checkout '+cbb.branch)
-    raw_src_stats = cbb._run_cmd('git log --shortstat --format=format:%at')
+    raw_src_stats = cbb._stream_cmd('git log --shortstat --format=format:%at')
     src_stats = []
     for line in raw_src_stats:
         try:
@@ -131,10 +132,11 @@ def main():
            }
     for benchmark_name in benchmark_names:
         char_proj = SetupCharacterizationProjects(benchmarks[benchmark_name], tool)
-        projs = char_proj.build_directory_structure()
+        projs = char_proj.build_directory_structure(lazy=True)
 
-        tmin_data = collect_tmin_data(projs[1])
-        util_data = collect_util_data(projs[1])
+        results = read_results(char_proj, tool)
+        tmin_data = collect_tmin_data(projs[1], results)
+        util_data = collect_util_data(projs[1], results)
 
         src_stats = get_src_stats(char_proj.cbb)
         data[benchmark_name] = (src_stats, util_data, tmin_data)
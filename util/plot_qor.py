@@ -4,19 +4,39 @@ import sys
 import os
 
 from characterize_benchmark import SetupCharacterizationProjects
+from results_store import ResultsStore, commit_of
+from report_parser import read_report
+from tool_automation import Vivado
 sys.path.insert(1, os.path.join('..'))
 from build_benchmark import get_available_benchmarks
 
-def collect_tmin_data(proj_list):
+def read_results(char_proj, tool):
     '''
-    Read the results of the F_max binary search (tmin.txt) for each project in
-    proj_list.
+    Read the PnR results of every commit from the results database of the
+    characterization projects, with a single query.
+
+    Returns a dictionary of {<commit hash>: <result row>}, empty if there is
+    no database (e.g. for sweeps run before it was added).
+    '''
+    if not os.path.isfile(char_proj.results_db):
+        return {}
+    rows = ResultsStore(char_proj.results_db).step_results(char_proj.cbb.name, tool, 'pnr')
+    return {row['commit_hash']: row for row in rows}
+
+def collect_tmin_data(proj_list, results={}):
+    '''
+    Read the results of the F_max binary search for each project in
+    proj_list, from <results> (see read_results()) or else tmin.txt.
 
     Returns a sorted 3-tuple formatted as ([commit numbers], [fmax_mid], [fmax_uncertainty])
     '''
     tmin_data = []
     for path in proj_list:
         commit = str(os.path.split(path)[1]).split('_')[0]
+        row = results.get(commit_of(path)[1])
+        if row is not None and row['tmin_low'] is not None and row['tmin_high'] is not None:
+            tmin_data.append((commit, row['tmin_low'], row['tmin_high']))
+            continue
         path = os.path.join(path, 'tmin.txt')
         try:
             with open(path, 'r') as data:
@@ -42,27 +62,27 @@ def collect_tmin_data(proj_list):
     tmin_data_unc = [y[1] - y[2] for y in tmin_data]
     return (tmin_data_x, tmin_data_mid, tmin_data_unc)
 
-# TODO: this is Vivado specific
-def collect_util_data(proj_list):
+def collect_util_data(proj_list, results={}, tool=Vivado):
     '''
-    Read the results of the vivado utilization reports for each project in proj_list
+    Read the area of each project in proj_list, from <results> (see
+    read_results()) or else the utilization report of <tool> (a
+    tool_automation class)
 
-    Returns a sorted 2-tuple formatted as ([commit numbers], [CLB LUT counts])
+    Returns a sorted 2-tuple formatted as ([commit numbers], [area, e.g. CLB LUT counts])
     '''
     util_data = []
     for path in proj_list:
         commit = str(os.path.split(path)[1]).split('_')[0]
-        path = os.path.join(path, 'autoxpr', 'util.log')
-        try:
-            with open(path, 'r') as data:
-                report = data.readlines()
-                for line in report:
-                    if "CLB LUTs" in line:
-                        area = int(line.split('|')[2])
-                        break
+        row = results.get(commit_of(path)[1])
+        if row is not None and row['area'] is not None:
+            util_data.append((commit, row['area']))
+            continue
+        path = os.path.join(path, tool.util_logfile_name)
+        area = getattr(read_report(path, tool.util_report), tool.area_metric)
+        if area is None:
+            print("WARNING: no utilization data at "+str(path))
+        else:
             util_data.append((commit, area))
-        except FileNotFoundError:
-            print("WARNING: no utilization log at "+str(path))
     util_data = sorted(util_data, key=lambda dp: dp[0])
     util_data_x = [int(x[0]) for x in util_data]
     util_data_y = [y[1] for y in util_data]
@@ -123,10 +143,11 @@ def main():
 
     for benchmark_name in to_plot.keys():
         char_proj = SetupCharacterizationProjects(benchmarks[benchmark_name], tool)
-        projs = char_proj.build_directory_structure()
+        projs = char_proj.build_directory_structure(lazy=True)
 
-        tmin_data = collect_tmin_data(projs[1])
-        util_data = collect_util_data(projs[1])
+        results = read_results(char_proj, tool)
+        tmin_data = collect_tmin_data(projs[1], results)
+        util_data = collect_util_data(projs[1], results)
 
         to_plot[benchmark_name] = (util_data, tmin_data)
 
@@ -0,0 +1,248 @@
+import os
+import re
+import json
+
+# bump when a parser changes, so cached metrics are parsed again
+_parser_version = 1
+
+class Report:
+    '''
+    Metrics extracted from a tool report. Metrics the report does not hold
+    are None.
+
+    success: True if the report shows the step succeeded (for Vivado timing
+             reports: timing was met)
+    wns, tns: worst and total negative setup slack, in ns
+    period: the constrained clock period, in ns
+    luts, ffs, brams, dsps, alms: resources used
+    '''
+    fields = ['success', 'wns', 'tns', 'period', 'luts', 'ffs', 'brams', 'dsps', 'alms']
+
+    def __init__(self, **metrics):
+        for field in self.fields:
+            setattr(self, field, metrics.get(field))
+        if self.success is None:
+            self.success = False
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+def _number(text):
+    '''
+    Returns the number at the start of <text> (e.g. '1,234 / 61,510'), or
+    None if there is none
+    '''
+    match = re.match(r'\s*(-?[0-9][0-9,]*(?:\.[0-9]+)?)', text)
+    if match is None:
+        return None
+    value = match.group(1).replace(',', '')
+    return float(value) if '.' in value else int(value)
+
+def _parse_vivado_log(lines):
+    '''
+    Vivado's log (or tool session transcript) of synthesis
+    '''
+    for line in lines:
+        if 'synth_design completed successfully' in line:
+            return {'success': True}
+    return {}
+
+def _parse_vivado_timing(lines):
+    '''
+    report_timing output, e.g.
+    'Slack (VIOLATED) :        -0.123ns  (required time - arrival time)'
+    'Requirement:            5.000ns  (clk rise@5.000ns - clk rise@0.000ns)'
+    or the design timing summary of report_timing_summary
+    '''
+    metrics = {}
+    summary = False
+    for line in lines:
+        if 'Slack (MET) :' in line:
+            metrics['success'] = True
+        match = re.match(r'\s*Slack(?: \(\w+\))?\s*:\s*(-?[0-9.]+)ns', line)
+        if match and 'wns' not in metrics:
+            metrics['wns'] = float(match.group(1))
+            continue
+        match = re.match(r'\s*Requirement:\s*([0-9.]+)ns', line)
+        if match and 'period' not in metrics:
+            metrics['period'] = float(match.group(1))
+            continue
+        # report_timing_summary: a 'WNS(ns) TNS(ns) ...' header, a line of
+        # dashes, then the values
+        if re.match(r'\s*WNS\(ns\)\s+TNS\(ns\)', line):
+            summary = True
+        elif summary and line.strip().strip('- ') != '':
+            values = line.split()
+            try:
+                metrics['wns'] = float(values[0])
+                metrics['tns'] = float(values[1])
+            except (IndexError, ValueError):
+                pass
+            summary = False
+    return metrics
+
+# first row of the report_utilization tables for each resource, for
+# UltraScale ('CLB') and 7 series ('Slice') parts
+_vivado_util_rows = {
+    'CLB LUTs': 'luts',
+    'Slice LUTs': 'luts',
+    'CLB Registers': 'ffs',
+    'Slice Registers': 'ffs',
+    'Block RAM Tile': 'brams',
+    'DSPs': 'dsps',
+}
+
+def _parse_vivado_util(lines):
+    '''
+    report_utilization output, e.g. '| CLB LUTs | 322 | 0 | 394080 | 0.08 |'
+    '''
+    metrics = {}
+    for line in lines:
+        if not line.startswith('|'):
+            continue
+        fields = line.split('|')
+        if len(fields) < 3:
+            continue
+        name = fields[1].strip().rstrip('*').strip()
+        if name in _vivado_util_rows and _vivado_util_rows[name] not in metrics:
+            value = _number(fields[2])
+            if value is not None:
+                metrics[_vivado_util_rows[name]] = value
+    return metrics
+
+# rows of the Quartus summaries, formatted as '; <name> ; <value> ;' in
+# reports, or '<name> : <value>' in .summary files
+_quartus_summary_rows = {
+    'Logic utilization (in ALMs)': 'alms',
+    'Total registers': 'ffs',
+    'Total RAM Blocks': 'brams',
+    'Total DSP Blocks': 'dsps',
+}
+
+def _quartus_row(line):
+    '''
+    Split a Quartus report or summary line into its fields
+    '''
+    if line.startswith(';'):
+        return [field.strip() for field in line.strip().strip(';').split(';')]
+    return [field.strip() for field in line.split(' : ', 1)]
+
+def _parse_quartus_summary(lines, status):
+    '''
+    Quartus synthesis or fitter report (or summary). <status> is the name of
+    the summary row that holds the step's status, e.g. 'Fitter Status'.
+    '''
+    metrics = {}
+    for line in lines:
+        if 'Info: Successfully synthesized' in line:
+            metrics['success'] = True
+        fields = _quartus_row(line)
+        if len(fields) < 2:
+            continue
+        if fields[0] == status:
+            metrics['success'] = fields[1].startswith('Successful')
+        elif fields[0] in _quartus_summary_rows and _quartus_summary_rows[fields[0]] not in metrics:
+            value = _number(fields[1])
+            if value is not None:
+                metrics[_quartus_summary_rows[fields[0]]] = value
+    return metrics
+
+def _parse_quartus_syn(lines):
+    return _parse_quartus_summary(lines, 'Analysis & Synthesis Status')
+
+def _parse_quartus_fit(lines):
+    return _parse_quartus_summary(lines, 'Fitter Status')
+
+def _parse_quartus_sta(lines):
+    '''
+    Quartus Timing Analyzer report: the worst setup slack and end point TNS
+    over all timing models from the Setup Summary tables, and the period of
+    the first clock in the Clocks table
+    '''
+    metrics = {}
+    section = None
+    period_column = None
+    for line in lines:
+        if 'Quartus Prime Timing Analyzer was successful. 0 errors, 0 warnings' in line:
+            metrics['success'] = True
+        if 'Setup Summary' in line:
+            section = 'setup'
+        elif line.startswith(';') and _quartus_row(line) == ['Clocks']:
+            section = 'clocks'
+        elif line.strip() == '':
+            section = None
+        elif section is not None and line.startswith(';'):
+            fields = _quartus_row(line)
+            if section == 'setup':
+                # ; <clock> ; <slack> ; <end point TNS> ;
+                slack = _number(fields[1]) if len(fields) > 1 else None
+                if slack is None:
+                    continue # table header
+                if metrics.get('wns') is None or slack < metrics['wns']:
+                    metrics['wns'] = slack
+                tns = _number(fields[2]) if len(fields) > 2 else None
+                if tns is not None and (metrics.get('tns') is None or tns < metrics['tns']):
+                    metrics['tns'] = tns
+            elif section == 'clocks':
+                if 'Period' in fields:
+                    period_column = fields.index('Period')
+                elif period_column is not None and 'period' not in metrics and len(fields) > period_column:
+                    metrics['period'] = _number(fields[period_column])
+    for field in ['wns', 'tns', 'period']:
+        if field in metrics and metrics[field] is not None:
+            metrics[field] = float(metrics[field])
+    return metrics
+
+# parsers by report kind
+parsers = {
+    'vivado_log': _parse_vivado_log,
+    'vivado_timing': _parse_vivado_timing,
+    'vivado_util': _parse_vivado_util,
+    'quartus_syn': _parse_quartus_syn,
+    'quartus_fit': _parse_quartus_fit,
+    'quartus_sta': _parse_quartus_sta,
+}
+
+def _cache_path(path):
+    '''
+    The metrics of <path> are cached next to it, in .<name>.metrics.json
+    '''
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.'+name+'.metrics.json')
+
+def read_report(path, kind):
+    '''
+    Parse the report <path> with the parser for <kind> (see parsers). The
+    report is read once, line by line, and the metrics are cached next to
+    it keyed by its modification time and size, so unchanged reports are
+    never read again.
+
+    Returns a Report, which is empty (and unsuccessful) if the report does
+    not exist.
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return Report()
+    key = [kind, _parser_version, stat.st_mtime_ns, stat.st_size]
+    cache = _cache_path(path)
+    try:
+        with open(cache, 'r') as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return Report(**cached['metrics'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass # not cached yet, or unreadable
+
+    with open(path, 'r', errors='replace') as f:
+        report = Report(**parsers[kind](f))
+    # write to a temporary file first, so concurrent readers never see half
+    # a cache file
+    temp = cache+'.'+str(os.getpid())
+    try:
+        with open(temp, 'w') as f:
+            json.dump({'key': key, 'metrics': report.as_dict()}, f)
+        os.replace(temp, cache)
+    except OSError:
+        pass # e.g. a read only directory, just don't cache
+    return report
@@ -0,0 +1,165 @@
+import os
+import resource
+import threading
+
+def _descendants():
+    '''
+    Find every process descended from this one.
+
+    Returns a dictionary of {<pid>: <fields of /proc/<pid>/stat after the
+    command name>}, or None if /proc is not available.
+    '''
+    try:
+        pids = [int(pid) for pid in os.listdir('/proc') if pid.isdigit()]
+    except FileNotFoundError:
+        return None
+    children = {}
+    stats = {}
+    for pid in pids:
+        try:
+            with open('/proc/'+str(pid)+'/stat', 'r') as f:
+                # the command name is in parentheses and may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue # exited while scanning
+        children.setdefault(int(fields[1]), []).append(pid)
+        stats[pid] = fields
+    found = {}
+    descendants = list(children.get(os.getpid(), []))
+    while len(descendants) > 0:
+        pid = descendants.pop()
+        found[pid] = stats[pid]
+        descendants = descendants + children.get(pid, [])
+    return found
+
+def _read_io(pid):
+    '''
+    Returns a tuple of the (<bytes read>, <bytes written>) from storage by
+    process <pid> so far, (0, 0) if it is not readable.
+    '''
+    io = {}
+    try:
+        with open('/proc/'+str(pid)+'/io', 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                io[name] = int(value)
+    except (OSError, ValueError):
+        pass
+    return (io.get('read_bytes', 0), io.get('write_bytes', 0))
+
+def pin_cpus(cpus):
+    '''
+    Restrict this process, and the tools it has all ready started (e.g. tool
+    sessions), to the CPUs in <cpus>. Tools started later inherit the
+    restriction.
+    '''
+    os.sched_setaffinity(0, cpus)
+    for pid in (_descendants() or {}).keys():
+        # affinity is per thread, so pin each thread of the tool
+        try:
+            threads = [int(tid) for tid in os.listdir('/proc/'+str(pid)+'/task')]
+        except OSError:
+            continue # exited
+        for tid in threads:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except OSError:
+                pass
+
+class ResourceMonitor:
+    '''
+    Context manager that measures the resources used by the processes (i.e.
+    tools) this process runs while it is open: the peak of their combined
+    memory use, their user and system CPU time, and the bytes they read from
+    and wrote to storage.
+
+    Tools that exit (and are waited for) inside the context are measured
+    exactly with getrusage(). Tools still running at the end, like tool
+    sessions, are measured from /proc, which is sampled on a background
+    thread for the memory peak. Tools started by other threads of this
+    process are counted too, so monitors open at the same time on several
+    threads (e.g. the k-ary Tmin search) each measure all of them.
+    '''
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        # in bytes, None if it could not be measured
+        self.peak_rss = None
+        # in seconds
+        self.cpu_user = None
+        self.cpu_system = None
+        # in bytes
+        self.read_bytes = None
+        self.write_bytes = None
+        self._first = None
+        self._last = {}
+        self._usage = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        '''
+        Record the memory use, CPU times and I/O of the running tools
+        '''
+        procs = _descendants()
+        if procs is None:
+            return
+        rss = 0
+        sample = {}
+        for pid, fields in procs.items():
+            rss = rss + int(fields[21])*os.sysconf('SC_PAGE_SIZE')
+            sample[pid] = (int(fields[11]), int(fields[12])) + _read_io(pid)
+        # nothing running (yet) is not a measurement, so a run too short
+        # to be sampled leaves the peak unknown
+        if rss and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+        if self._first is None:
+            self._first = sample
+        self._last = sample
+
+    def _sampler(self):
+        while not self._done.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._sample()
+        self._thread = threading.Thread(target=self._sampler, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self._sample()
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # tools that exited were waited for, so getrusage() counts them
+        user = usage.ru_utime - self._usage.ru_utime
+        system = usage.ru_stime - self._usage.ru_stime
+        read = (usage.ru_inblock - self._usage.ru_inblock)*512
+        write = (usage.ru_oublock - self._usage.ru_oublock)*512
+        # tools still running are only in /proc, count what they used since
+        # the context was opened
+        ticks = os.sysconf('SC_CLK_TCK')
+        for pid, last in self._last.items():
+            first = (self._first or {}).get(pid, (0, 0, 0, 0))
+            user = user + (last[0] - first[0])/ticks
+            system = system + (last[1] - first[1])/ticks
+            read = read + last[2] - first[2]
+            write = write + last[3] - first[3]
+        self.cpu_user = user
+        self.cpu_system = system
+        self.read_bytes = read
+        self.write_bytes = write
+        return False
+
+    def stats(self):
+        '''
+        Returns the measurements as a dictionary of {<name>: <value>}
+        '''
+        return {
+            'peak_rss': self.peak_rss,
+            'cpu_user': self.cpu_user,
+            'cpu_system': self.cpu_system,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
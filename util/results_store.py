@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+
+# one row per benchmark/commit/tool/step/iteration. iteration 0 is the
+# result of the whole step, iterations 1, 2, ... are the PnR runs of its Tmin
+# search, in the order they finished
+_schema = [
+    '''CREATE TABLE IF NOT EXISTS results (
+        benchmark TEXT NOT NULL,
+        commit_idx INTEGER NOT NULL,
+        commit_hash TEXT NOT NULL,
+        tool TEXT NOT NULL,
+        step TEXT NOT NULL,
+        iteration INTEGER NOT NULL,
+        success INTEGER,
+        elapsed REAL,
+        period REAL,
+        slack REAL,
+        tmin_low REAL,
+        tmin_high REAL,
+        area INTEGER,
+        peak_rss INTEGER,
+        cpu_user REAL,
+        cpu_system REAL,
+        read_bytes INTEGER,
+        write_bytes INTEGER,
+        PRIMARY KEY (benchmark, commit_hash, tool, step, iteration)
+    )''',
+    'CREATE INDEX IF NOT EXISTS results_by_commit_idx ON results (benchmark, tool, step, commit_idx)',
+]
+
+columns = ['benchmark', 'commit_idx', 'commit_hash', 'tool', 'step', 'iteration', 'success',
+           'elapsed', 'period', 'slack', 'tmin_low', 'tmin_high', 'area', 'peak_rss', 'cpu_user',
+           'cpu_system', 'read_bytes', 'write_bytes']
+
+def commit_of(proj_dir):
+    '''
+    Returns a tuple of the (<commit index>, <commit hash>) of the commit
+    directory <proj_dir>, named <index>_<hash>
+    '''
+    idx, _, sha = os.path.basename(os.path.normpath(proj_dir)).partition('_')
+    return (int(idx), sha)
+
+class ResultsStore:
+    '''
+    SQLite database of characterization results, shared by all the workers of
+    a sweep. The database is in WAL mode, so workers (processes and threads,
+    each with their own connection) can write while others read.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            for statement in _schema:
+                db.execute(statement)
+
+    def _connect(self):
+        '''
+        Returns the calling thread's connection, opening it if needed.
+        Connections are not shared with forked processes.
+        '''
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            # in WAL mode a commit is still atomic without a sync per write
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def record(self, row):
+        '''
+        Insert (or replace) the row <row>, a dictionary of {<column>: <value>}.
+        Missing columns are NULL.
+        '''
+        values = [row.get(column) for column in columns]
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO results ('+', '.join(columns)+') VALUES ('
+                       +', '.join(['?']*len(columns))+')', values)
+
+    def clear_iterations(self, benchmark, commit_hash, tool, step):
+        '''
+        Remove the PnR runs recorded for a step, before its Tmin search is
+        run again
+        '''
+        with self._connect() as db:
+            db.execute('DELETE FROM results WHERE benchmark=? AND commit_hash=? AND tool=? AND step=? AND iteration>0',
+                       (benchmark, commit_hash, tool, step))
+
+    def step_result(self, benchmark, commit_hash, tool, step):
+        '''
+        Returns the result row of a step as a dictionary, or None if it has not
+        been recorded
+        '''
+        cursor = self._connect().execute(
+            'SELECT '+', '.join(columns)+' FROM results WHERE benchmark=? AND commit_hash=? AND tool=? AND step=? AND iteration=0',
+            (benchmark, commit_hash, tool, step))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(columns, row))
+
+    def step_results(self, benchmark, tool, step, iterations=False):
+        '''
+        Returns the result rows of <step> for every commit of <benchmark>, as a
+        list of dictionaries sorted by commit index. With <iterations> the rows
+        of the PnR runs are returned instead.
+        '''
+        cursor = self._connect().execute(
+            'SELECT '+', '.join(columns)+' FROM results WHERE benchmark=? AND tool=? AND step=? AND iteration'
+            +('>0' if iterations else '=0')+' ORDER BY commit_idx, iteration',
+            (benchmark, tool, step))
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -1,6 +1,46 @@
 import os
 import subprocess
 import time
+import tempfile
+import math
+import shutil
+import concurrent.futures
+import hashlib
+import json
+
+from tool_session import TclSession, ToolSessionError, get_session
+from resource_monitor import ResourceMonitor
+from results_store import commit_of
+from report_parser import read_report
+
+def _tree_hash(path):
+    '''
+    Returns the git tree hash of the directory <path>, as `git write-tree`
+    would compute it if <path> was the root of a repository.
+    '''
+    entries = []
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.islink(full):
+            mode = b'120000'
+            data = os.readlink(full).encode('utf8', 'surrogateescape')
+            sha = hashlib.sha1(b'blob '+str(len(data)).encode()+b'\0'+data).digest()
+            sort_name = name
+        elif os.path.isdir(full):
+            mode = b'40000'
+            sha = bytes.fromhex(_tree_hash(full))
+            # git sorts directories as if their names ended in '/'
+            sort_name = name+'/'
+        else:
+            mode = b'100755' if os.access(full, os.X_OK) else b'100644'
+            with open(full, 'rb') as f:
+                data = f.read()
+            sha = hashlib.sha1(b'blob '+str(len(data)).encode()+b'\0'+data).digest()
+            sort_name = name
+        name = name.encode('utf8', 'surrogateescape')
+        entries.append((sort_name.encode('utf8', 'surrogateescape'), mode+b' '+name+b'\0'+sha))
+    tree = b''.join([entry for _, entry in sorted(entries)])
+    return hashlib.sha1(b'tree '+str(len(tree)).encode()+b'\0'+tree).hexdigest()
 
 class AbstractFPGATool:
     '''
@@ -8,21 +48,108 @@ class AbstractFPGATool:
     '''
     tool_name = 'ABSTRACT'
 
+    # reports are parsed with the report_parser parser of their kind
     synth_script_name  = 'ABSTRACT_synth_script.tcl'
-    synth_success_msg  = 'ABSTRACT SYNTH SUCCESS'
     synth_logfile_name = 'synth_log'
+    synth_report = 'ABSTRACT'
 
     pnr_script_name = 'ABSTRACT_pnr_script.tcl'
-    pnr_success_msg = 'ABSTRACT PNR SUCCESS'
     pnr_logfile_name = 'pnr_log'
+    pnr_report = 'ABSTRACT'
+
+    util_logfile_name = 'util_log'
+    util_report = 'ABSTRACT'
+    # the metric of the utilization report that is the design's area
+    area_metric = 'luts'
 
     sdc_name = 'ABSTRACT.sdc'
     fmax_search_steps = 5
     period_ns = 1
 
-    def __init__(self, proj_dir, chronbench_benchmark):
+    # files and directories (relative to the project) that hold the results
+    # of a PnR run
+    pnr_outputs = []
+
+    # command that starts the tool in an interactive Tcl mode, if it can be
+    # run as a long-lived session (see tool_session.py)
+    session_cmd = None
+
+    # Tmin search strategies supported by the tool
+    fmax_searches = ['binary', 'kary', 'slack']
+    # compilation flows supported by the tool. 'scratch' compiles every
+    # commit from scratch, 'incremental' starts from the results of the
+    # previous commit
+    flows = ['scratch']
+
+    # names of the steps in result files, and of the Tmin search results
+    synth_step = 'synth'
+    pnr_step = 'pnr'
+    tmin_name = 'tmin.txt'
+    # a line per PnR run of the Tmin search, with its resource use
+    pnr_runs_name = 'pnr_runs.txt'
+    run_stats = ['peak_rss', 'cpu_user', 'cpu_system', 'read_bytes', 'write_bytes']
+
+    part = 'ABSTRACT'
+    # files and directories (relative to the project) that hold the results
+    # of synthesis, including everything PnR needs
+    synth_outputs = []
+
+    def __init__(self, proj_dir, chronbench_benchmark, fmax_search='binary', fmax_k=4,
+                 fmax_abs_tol=0.01, fmax_rel_tol=0.005, fmax_max_runs=None, tool_session=False,
+                 result_cache=None, flow='scratch', threads=1, results_store=None, session_timeout=None):
         self.proj_dir = proj_dir
         self.cbb = chronbench_benchmark
+        # Tmin search strategy: 'binary' runs one PnR at a time, 'kary' runs
+        # fmax_k PnR runs at once
+        self.fmax_search = fmax_search
+        self.fmax_k = fmax_k
+        # the search stops once Tmin is bracketed to within fmax_abs_tol ns
+        # (the SDC file only has 0.01ns resolution) or fmax_rel_tol of the
+        # period, or after fmax_max_runs PnR runs (rounds for 'kary')
+        self.fmax_abs_tol = fmax_abs_tol
+        self.fmax_rel_tol = fmax_rel_tol
+        if fmax_max_runs is not None:
+            self.fmax_search_steps = fmax_max_runs
+        # if True run scripts in a long-lived tool session shared with the
+        # other projects run by the same worker, instead of starting the tool
+        # for every script
+        self.tool_session = tool_session
+        # seconds a session may go without output before it is considered
+        # hung and restarted, None to wait forever
+        self.session_timeout = session_timeout
+        # a session used only by this project, overriding the worker's
+        self.session = None
+        # if given, a directory of step results shared by all projects (and
+        # benchmark rebuilds), keyed by the project's sources and settings
+        self.result_cache = result_cache
+        self._tree = None
+        self.flow = flow
+        # the number of threads the tool may use
+        self.threads = threads
+        # if given, a ResultsStore that step results are recorded in, in
+        # addition to the project's result files
+        self.store = results_store
+        # the tool object of the previous commit, whose results the
+        # incremental flow starts from (None for the first commit)
+        self.reference = None
+        if flow == 'incremental':
+            # keep the incremental results next to the from scratch ones
+            self.synth_step = 'synth_incr'
+            self.pnr_step = 'pnr_incr'
+            self.tmin_name = 'tmin_incr.txt'
+            self.pnr_runs_name = 'pnr_runs_incr.txt'
+        # relative step size of the first Tmin guesses
+        self.coef = 0.5
+        # True if the search was seeded from a neighbouring commit
+        self.warm_started = False
+        # results of PnR runs so far, keyed by the period as written to the
+        # SDC file. see _run_pnr_iteration()
+        self._pnr_results = {}
+        # the SDC period of the PnR run whose outputs are in the project
+        self._routed_period = None
+        # the project whose record of PnR runs this project's runs are added
+        # to (see _record_run())
+        self.runs_project = self
 
     def _write_file(self, path, name, contents):
         '''
@@ -33,16 +160,30 @@ class AbstractFPGATool:
             for line in contents:
                 to_write.write(line+'\n')
 
-    def _check_log(self, logfile, success_msg):
+    def _read_report(self, name, kind):
         '''
-        Check each line of logfile to see if it contains success_msg.
+        Parse the report <name> (relative to the project) of <kind>.
+
+        Returns a report_parser.Report, unsuccessful if the report is missing
         '''
-        with open(logfile, 'r') as log:
-            loglines = log.readlines()
-        for line in loglines:
-            if success_msg in line:
-                return True
-        return False
+        return read_report(os.path.join(self.proj_dir, name), kind)
+
+    def _source_in_session(self, script_name, transcript):
+        '''
+        Run a script from the project directory in the tool session, writing
+        its output to <transcript> (relative to the project directory). If the
+        session fails the transcript holds the error instead.
+        '''
+        session = self.session
+        if session is None:
+            session = get_session(self.session_cmd, self.session_timeout)
+        transcript = os.path.join(self.proj_dir, transcript)
+        try:
+            session.source(script_name, self.proj_dir, transcript)
+        except ToolSessionError as e:
+            print('WARNING: '+self.proj_dir+': '+str(e))
+            with open(transcript, 'w') as f:
+                f.write(str(e)+'\n')
 
     def _result_file_path(self, success, step):
         '''
@@ -54,26 +195,80 @@ class AbstractFPGATool:
             r = 'FAIL'
         return os.path.join(self.proj_dir, self.tool_name+'_'+step+'.'+r)
 
-    def _report_result(self, success, elapsed, step):
+    def _report_result(self, success, elapsed, step, stats={}):
         '''
         write a result file to the project directory named
         <tool>_<step>.[PASS|FAIL], that contains the time elapsed to produce
-        the result. Also print this information to the terminal.
+        the result, followed by a '<name> <value>' line for each of <stats>.
+        Also print this information to the terminal.
         '''
         with open(self._result_file_path(success, step), 'w') as f:
             f.write(str(elapsed)+'\n')
+            for name in sorted(stats.keys()):
+                if stats[name] is not None:
+                    f.write(name+' '+str(stats[name])+'\n')
         print(self.proj_dir+': '+step+' '+str(success)+', '+str(elapsed))
 
+    def read_result(self, step):
+        '''
+        Read the result file of <step>, if it exists.
+
+        Returns a tuple of (<success>, <elapsed>), or None if <step> has not
+        been run.
+        '''
+        if self.store is not None:
+            row = self.store.step_result(*self._store_key(step))
+            if row is not None:
+                return (bool(row['success']), row['elapsed'])
+        for success in [True, False]:
+            try:
+                with open(self._result_file_path(success, step), 'r') as f:
+                    return (success, float(f.readline()))
+            except FileNotFoundError:
+                pass
+        return None
+
+    def read_result_stats(self, step):
+        '''
+        Read the extra statistics of <step> from its result file, e.g.
+        'peak_rss' (the peak memory use of the tool, in bytes).
+
+        Returns a dictionary of {<name>: <value>}, empty if <step> has not
+        been run or recorded no statistics.
+        '''
+        stats = {}
+        for success in [True, False]:
+            try:
+                with open(self._result_file_path(success, step), 'r') as f:
+                    lines = f.readlines()[1:]
+            except FileNotFoundError:
+                continue
+            for line in lines:
+                fields = line.split()
+                if len(fields) == 2:
+                    stats[fields[0]] = float(fields[1])
+            break
+        return stats
+
     def _check_step_complete(self, step):
         '''
-        Check to see if a result file for <step> exists.
+        Check to see if a result for <step> exists, in the results store or
+        as a result file. Results that only have a file (e.g. from before
+        the store was used) are added to the store.
 
         Returns true if this step has been run (even if it was unsucessful).
 
         Prints results to terminal
         '''
+        if self.store is not None:
+            row = self.store.step_result(*self._store_key(step))
+            if row is not None:
+                print(self.proj_dir+': Nothing to be done -- '+('PASSED ' if row['success'] else 'FAILED ')+step)
+                return True
         passed_step = os.path.isfile(self._result_file_path(True, step))
         failed_step = os.path.isfile(self._result_file_path(False, step))
+        if passed_step or failed_step:
+            self.record_in_store(step)
         if passed_step:
             print(self.proj_dir+': Nothing to be done -- PASSED '+step)
             return True
@@ -88,11 +283,16 @@ class AbstractFPGATool:
 
         If a synthesis results file all ready exists for this commit skip it
         and print a message.
+
+        Returns True if synthesis succeeded (now or in an earlier run).
         '''
         # Check to see if this project has all ready been synthesized
-        synth_done = self._check_step_complete('synth')
+        synth_done = self._check_step_complete(self.synth_step)
         if synth_done:
-            return
+            return self.read_result(self.synth_step)[0]
+        if self._restore_cached_result(self.synth_step):
+            self.record_in_store(self.synth_step)
+            return self.read_result(self.synth_step)[0]
 
         # create the synthesis script
         synth_script = self._build_synth_script()
@@ -100,14 +300,17 @@ class AbstractFPGATool:
 
         # run the synthesis tool
         start = time.time()
-        self._run_synthesis_tool()
+        with ResourceMonitor() as monitor:
+            self._run_synthesis_tool()
         stop = time.time()
         elapsed = stop - start
 
         # report the results of synthesis
-        logfile = os.path.join(self.proj_dir, self.synth_logfile_name)
-        success = self._check_log(logfile, self.synth_success_msg)
-        self._report_result(success, elapsed, 'synth')
+        success = self._read_report(self.synth_logfile_name, self.synth_report).success
+        self._report_result(success, elapsed, self.synth_step, monitor.stats())
+        self._store_cached_result(self.synth_step)
+        self.record_in_store(self.synth_step)
+        return success
 
     def _build_synth_script(self):
         pass
@@ -122,69 +325,594 @@ class AbstractFPGATool:
         '''
         # Check to see if this project has all ready been placed and routed.
         # XXX: Assume this function will only be run after synthesis
-        pnr_done = self._check_step_complete('pnr')
+        pnr_done = self._check_step_complete(self.pnr_step)
         if pnr_done:
             return
+        if self._restore_cached_result(self.pnr_step):
+            self.record_in_store(self.pnr_step)
+            return
 
         # create the pnr script
         pnr_script = self._build_pnr_script()
         self._write_file(self.proj_dir, self.pnr_script_name, pnr_script)
 
         start = time.time()
+        # start a fresh record of this search's PnR runs
+        self._write_file(self.proj_dir, self.pnr_runs_name, [' '.join(['#period', 'success', 'slack', 'elapsed']+self.run_stats)])
+        with ResourceMonitor() as monitor:
+            if self.fmax_search == 'kary':
+                guesses = self._kary_fmax_search()
+            elif self.fmax_search == 'slack':
+                guesses = self._slack_fmax_search()
+            elif self.fmax_search == 'intool':
+                guesses = self._intool_fmax_search()
+            else:
+                guesses = self._binary_fmax_search()
+        stop = time.time()
+        elapsed = stop - start
+
+        success = True
+        # TODO
+
+        # report the results of the Tmin search
+        self._report_result(success, elapsed, self.pnr_step, monitor.stats())
+        # record the value of Tmin found
+        self._write_file(self.proj_dir, self.tmin_name, guesses)
+        self._store_cached_result(self.pnr_step)
+        self.record_in_store(self.pnr_step)
+
+    def _store_key(self, step):
+        '''
+        Returns the (<benchmark>, <commit hash>, <tool>, <step>) that identify
+        the result of <step> in the results store
+        '''
+        return (self.cbb.name, commit_of(self.proj_dir)[1], self.tool_name, step)
+
+    def record_in_store(self, step):
+        '''
+        Record the result of <step> (read back from the project's result
+        files) in the results store, along with the PnR runs of its Tmin
+        search.
+        '''
+        if self.store is None:
+            return
+        result = None
+        for success in [True, False]:
+            if os.path.isfile(self._result_file_path(success, step)):
+                with open(self._result_file_path(success, step), 'r') as f:
+                    result = (success, float(f.readline()))
+                break
+        if result is None:
+            return
+        benchmark, commit_hash, tool, _ = self._store_key(step)
+        row = {
+            'benchmark': benchmark,
+            'commit_idx': commit_of(self.proj_dir)[0],
+            'commit_hash': commit_hash,
+            'tool': tool,
+            'step': step,
+            'iteration': 0,
+            'success': int(result[0]),
+            'elapsed': result[1],
+        }
+        row.update(self.read_result_stats(step))
+        if step == self.pnr_step:
+            runs = self.read_runs()
+            bracket = self.read_tmin_bracket()
+            if bracket is not None:
+                row['tmin_low'], row['tmin_high'] = bracket
+                # the outputs in the project are those of the best passing run
+                for run in runs:
+                    if bracket[1] is not None and self._sdc_period(run['period']) == self._sdc_period(bracket[1]):
+                        row['period'] = run['period']
+                        row['slack'] = run['slack']
+            row['area'] = self._read_area()
+            self.store.clear_iterations(benchmark, commit_hash, tool, step)
+            for iteration, run in enumerate(runs):
+                run_row = dict(row)
+                for column in ['tmin_low', 'tmin_high', 'area']:
+                    run_row.pop(column, None)
+                run_row.update(run)
+                run_row['success'] = int(run['success'])
+                run_row['iteration'] = iteration + 1
+                self.store.record(run_row)
+        self.store.record(row)
+
+    def _read_area(self):
+        '''
+        Read the area of the placed and routed design from the utilization
+        report.
+
+        Returns the area (see area_metric), or None if it was not reported.
+        '''
+        return getattr(self._read_report(self.util_logfile_name, self.util_report), self.area_metric)
+
+    def _script_version(self):
+        '''
+        A hash of this file, which generates the tool scripts and runs the
+        Tmin search
+        '''
+        with open(os.path.abspath(__file__), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:12]
+
+    def _source_tree(self):
+        '''
+        Returns the git tree hash of the project's sources
+        '''
+        if self._tree is None:
+            self._tree = _tree_hash(os.path.join(self.proj_dir, 'src'))
+        return self._tree
+
+    def _result_cache_key(self, step):
+        '''
+        Hash everything that determines the result of <step>: the sources
+        (by their git tree hash, so identical commits and rebuilt benchmarks
+        share results), the tool, part, the benchmark's settings for the tool
+        and the version of the scripts. PnR also depends on the Tmin search
+        settings.
+        '''
+        settings = {}
+        for field, value in self.cbb.benchmark.items():
+            if field in ['top', 'clock'] or field.startswith(self.tool_name+'-'):
+                settings[field] = value
+        key = {
+            'step': step,
+            'tree': self._source_tree(),
+            'tool': self.tool_name,
+            'part': self.part,
+            'settings': settings,
+            'scripts': self._script_version(),
+        }
+        if self.reference is not None:
+            key['reference'] = self.reference._source_tree()
+        if step == self.pnr_step:
+            key['fmax-search'] = [self.fmax_search, self.fmax_k, self.fmax_abs_tol,
+                                  self.fmax_rel_tol, self.fmax_search_steps]
+        key = json.dumps(key, sort_keys=True).encode('utf8')
+        return step+'-'+hashlib.sha256(key).hexdigest()[:32]
+
+    def _step_outputs(self, step):
+        '''
+        Returns the files that hold the result of <step>
+        '''
+        result_files = [os.path.basename(self._result_file_path(r, step)) for r in [True, False]]
+        if step == self.synth_step:
+            return self.synth_outputs + [self.synth_script_name] + result_files
+        return self.pnr_outputs + [self.sdc_name, self.tmin_name, self.pnr_runs_name] + result_files
+
+    def _restore_cached_result(self, step):
+        '''
+        Copy the result of <step> from the result cache, if it is there.
+
+        Returns True on a cache hit.
+        '''
+        if self.result_cache is None:
+            return False
+        entry = os.path.join(self.result_cache, self._result_cache_key(step))
+        if not os.path.isdir(entry):
+            return False
+        self._copy_outputs(self._step_outputs(step), entry, self.proj_dir)
+        print(self.proj_dir+': '+step+' result reused from '+entry)
+        return True
+
+    def _store_cached_result(self, step):
+        '''
+        Copy the result of <step> into the result cache
+        '''
+        if self.result_cache is None:
+            return
+        entry = os.path.join(self.result_cache, self._result_cache_key(step))
+        if os.path.isdir(entry):
+            return
+        os.makedirs(self.result_cache, exist_ok=True)
+        # copy to a temporary directory first, so other workers never see a
+        # partial entry
+        tmp = tempfile.mkdtemp(prefix='tmp.', dir=self.result_cache)
+        self._copy_outputs(self._step_outputs(step), self.proj_dir, tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another worker stored the same result first
+            shutil.rmtree(tmp)
+
+    def read_tmin_bracket(self):
+        '''
+        Read the result of this project's Tmin search (tmin.txt, or
+        tmin_incr.txt for the incremental flow).
+
+        Returns a tuple of (<largest failing period>, <smallest passing
+        period>), as found by the end of the search, either of which may be
+        None. Returns None if the search has not been run.
+        '''
+        try:
+            with open(os.path.join(self.proj_dir, self.tmin_name), 'r') as f:
+                guesses = f.readlines()
+        except FileNotFoundError:
+            return None
+        too_low = None
+        too_high = None
+        for guess in guesses:
+            if 'too low' in guess:
+                too_low = float(guess.split()[0])
+            elif 'too high' in guess:
+                too_high = float(guess.split()[0])
+        return (too_low, too_high)
+
+    def warm_start(self, tmin_bracket):
+        '''
+        Seed the Tmin search from the result of another (usually neighbouring)
+        commit, formatted as returned by read_tmin_bracket(). Consecutive
+        commits usually have nearly the same Tmin, so the search starts at
+        the other commit's Tmin with a step size matching its final bracket,
+        and needs fewer PnR runs to reach the same precision.
+
+        Brackets that are not closed on both sides are ignored.
+        '''
+        if tmin_bracket is None or None in tmin_bracket:
+            return
+        too_low, too_high = tmin_bracket
+        self.period_ns = too_high
+        # twice the bracket width, so the first step in either direction
+        # moves past the other commit's bracket
+        self.coef = min(0.5, max(1/64, 2*(too_high - too_low)/too_high))
+        self.warm_started = True
+
+    def _search_steps(self):
+        '''
+        Returns the number of PnR runs for a binary search. A warm started
+        search skips the halvings needed to get from the default step size
+        down to its seeded step size.
+        '''
+        saved = int(math.log2(0.5/self.coef))
+        return max(2, self.fmax_search_steps - saved)
+
+    def _sdc_period(self, period):
+        '''
+        Returns <period> as written to the SDC file
+        '''
+        return '{:.2f}'.format(period)
+
+    def _run_pnr_iteration(self, period):
+        '''
+        Place and route the design with the clock constrained to <period>.
+        Periods that round to the same SDC constraint as an earlier run reuse
+        its result instead of running PnR again.
+
+        Returns True if timing was met. The slack reported by the run (see
+        _read_slack()) is left in self.last_slack.
+        '''
+        key = self._sdc_period(period)
+        if key in self._pnr_results:
+            success, self.last_slack = self._pnr_results[key]
+            print('\tPNR: '+self.proj_dir+' @ T='+str(period)+'ns (same constraint as an earlier run)')
+            return success
+        inner_start = time.time()
+        self._write_sdc(period)
+        with ResourceMonitor() as monitor:
+            self._run_pnr_tool()
+        success = self._read_report(self.pnr_logfile_name, self.pnr_report).success
+        self.last_slack = self._read_slack()
+        self._pnr_results[key] = (success, self.last_slack)
+        self._routed_period = key
+        inner_stop = time.time()
+        inner_elapsed = inner_stop - inner_start
+        self._record_run(key, success, self.last_slack, inner_elapsed, monitor.stats())
+        print('\tPNR: '+self.proj_dir+' @ T='+str(period)+'ns (RT: '+str(inner_elapsed)+')')
+        return success
+
+    def _record_run(self, period, success, slack, elapsed, stats):
+        '''
+        Append a line for a PnR run to the project's record of PnR runs,
+        formatted as '<period> <1 if timing was met, else 0> <slack> <elapsed>'
+        followed by the run's <stats>, in the order of run_stats ('-' if not
+        measured).
+        '''
+        values = [slack, elapsed] + [stats.get(name) for name in self.run_stats]
+        line = [period, str(int(success))] + ['-' if v is None else str(v) for v in values]
+        with open(os.path.join(self.runs_project.proj_dir, self.pnr_runs_name), 'a') as f:
+            f.write(' '.join(line)+'\n')
+
+    def read_runs(self):
+        '''
+        Read the record of the PnR runs of the Tmin search.
+
+        Returns a list of dictionaries of {'period', 'success', 'slack',
+        'elapsed', <run_stats>...}, with None for values that were not
+        measured. The list is empty if PnR has not been run.
+        '''
+        runs = []
+        try:
+            with open(os.path.join(self.proj_dir, self.pnr_runs_name), 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return runs
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            run = {'period': float(fields[0]), 'success': fields[1] == '1',
+                   'slack': None if fields[2] == '-' else float(fields[2]), 'elapsed': float(fields[3])}
+            for name, value in zip(self.run_stats, fields[4:]):
+                run[name] = None if value == '-' else float(value)
+            runs.append(run)
+        return runs
+
+    def _converged(self, too_low, too_high):
+        '''
+        Returns True once Tmin is bracketed to within the search tolerance
+        '''
+        if too_low is None or too_high is None:
+            return False
+        return too_high - too_low <= max(self.fmax_abs_tol, self.fmax_rel_tol*too_high)
+
+    def _copy_outputs(self, outputs, src_dir, dst_dir):
+        '''
+        Copy the files and directories in <outputs> (relative paths) from one
+        directory to another, skipping any that don't exist
+        '''
+        for output in outputs:
+            src = os.path.join(src_dir, output)
+            dst = os.path.join(dst_dir, output)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, dirs_exist_ok=True)
+            elif os.path.isfile(src):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copyfile(src, dst)
+
+    def _keep_best(self, period):
+        '''
+        Save the results of the PnR run at <period>, the best passing period
+        so far, so they can be restored once the search is over. Nothing is
+        saved if <period> reused an earlier result, since those results were
+        all ready saved.
+        '''
+        if self._routed_period != self._sdc_period(period):
+            return
+        self._copy_outputs(self.pnr_outputs, self.proj_dir, os.path.join(self.proj_dir, 'fmax_best'))
+
+    def _restore_best(self, too_high):
+        '''
+        Leave the project with the routed results (and SDC file) of the best
+        passing period, <too_high>, restoring them from the copy saved by
+        _keep_best() if a later run overwrote them.
+        '''
+        best_dir = os.path.join(self.proj_dir, 'fmax_best')
+        if too_high is None:
+            print('\tPNR: '+self.proj_dir+' No guess met timing')
+        else:
+            self.period_ns = too_high
+            self._write_sdc(self.period_ns)
+            if self._routed_period != self._sdc_period(too_high):
+                self._copy_outputs(self.pnr_outputs, best_dir, self.proj_dir)
+                self._routed_period = self._sdc_period(too_high)
+            print('\tPNR: '+self.proj_dir+' Best guess T='+str(too_high)+'ns kept')
+        if os.path.isdir(best_dir):
+            shutil.rmtree(best_dir)
+
+    def _binary_fmax_search(self):
+        '''
+        Search for Tmin with one PnR run at a time, halving the step size
+        each time the search changes direction, until the search converges.
+
+        Returns the list of guesses, formatted as '<period> too [high|low]'
+        '''
         # run binary search to determine fmax
         last_guess_too_high = None
-        coef = 0.5
+        coef = self.coef
+        # a warm started search may begin with a step size that is too small,
+        # so it doubles the step size until the search first changes
+        # direction, giving back one of the steps it saved each time
+        gallop = self.warm_started
+        steps = self._search_steps()
+        too_low = None
+        too_high = None
         guesses = []
-        for _ in range(self.fmax_search_steps):
+        while len(guesses) < steps and not self._converged(too_low, too_high):
 
             # guess Tmin == self.period_ns
-            inner_start = time.time()
-            self._write_sdc(self.period_ns)
-            self._run_pnr_tool()
-            logfile = os.path.join(self.proj_dir, self.pnr_logfile_name)
-            success = self._check_log(logfile, self.pnr_success_msg)
-            inner_stop = time.time()
-            inner_elapsed = inner_stop - inner_start
-            print('\tPNR: '+self.proj_dir+' @ T='+str(self.period_ns)+'ns (RT: '+str(inner_elapsed)+')')
+            success = self._run_pnr_iteration(self.period_ns)
 
             if success: # self.period_ns too high
                 guesses.append(str(self.period_ns)+' too high')
+                if too_high is None or self.period_ns < too_high:
+                    too_high = self.period_ns
+                    self._keep_best(too_high)
                 if last_guess_too_high == False:
                     coef = coef/2
+                    gallop = False
+                elif last_guess_too_high == True and gallop:
+                    coef = min(0.5, coef*2)
+                    steps = min(self.fmax_search_steps, steps + 1)
                 self.period_ns = self.period_ns*(1-coef)
                 last_guess_too_high = True
             else: # self.period_ns too low
                 guesses.append(str(self.period_ns)+' too low')
+                if too_low is None or self.period_ns > too_low:
+                    too_low = self.period_ns
                 if last_guess_too_high == True:
                     coef = coef/2
+                    gallop = False
+                elif last_guess_too_high == False and gallop:
+                    coef = min(0.5, coef*2)
+                    steps = min(self.fmax_search_steps, steps + 1)
                 self.period_ns = self.period_ns*(1+coef)
                 last_guess_too_high = False
 
-        # we don't want to report area numbers if timing wasn't met. therefore
-        # may need to re-run last 'too high' guess to get a valid area number:
-        if last_guess_too_high == False:
-            for idx in reversed(range(len(guesses))):
-                tmin = float(guesses[idx].split()[0])
-                success = guesses[idx].split()[-1]
-                if success == 'high':
+        # we don't want to report area numbers if timing wasn't met, so keep
+        # the results of the best passing guess
+        self._restore_best(too_high)
+        return guesses
+
+    def _kary_candidates(self, too_low, too_high):
+        '''
+        Choose fmax_k periods to try at once. Inside a known bracket they are
+        evenly spaced, which narrows the bracket by a factor of fmax_k + 1.
+        Otherwise they spread out from the known side (or from period_ns) to
+        find a bracket, as far as coef of the period.
+        '''
+        k = self.fmax_k
+        coef = self.coef
+        if too_low is not None and too_high is not None:
+            return [too_low + (too_high - too_low)*i/(k + 1) for i in range(1, k + 1)]
+        elif too_high is not None:
+            return [too_high*(1 - coef*i/k) for i in range(1, k + 1)]
+        elif too_low is not None:
+            return [too_low*(1 + 2*coef*i/k) for i in range(1, k + 1)]
+        return [self.period_ns*(1 + coef*(2*i/(k + 1) - 1)) for i in range(1, k + 1)]
+
+    def _make_scratch_project(self, idx):
+        '''
+        Copy the project into a scratch directory so another PnR run can use
+        it concurrently.
+
+        Returns a tool object for the scratch copy
+        '''
+        scratch_dir = os.path.join(self.proj_dir, 'fmax_scratch_'+str(idx))
+        if os.path.isdir(scratch_dir):
+            shutil.rmtree(scratch_dir)
+        shutil.copytree(self.proj_dir, scratch_dir, ignore=shutil.ignore_patterns('fmax_scratch_*', 'fmax_best'))
+        # the scratch projects run at the same time, so split the threads
+        scratch = type(self)(scratch_dir, self.cbb, tool_session=self.tool_session, flow=self.flow,
+                             threads=max(1, self.threads//self.fmax_k),
+                             session_timeout=self.session_timeout)
+        scratch.reference = self.reference
+        scratch.runs_project = self
+        # the copied PnR script is for this project's thread count
+        scratch._write_file(scratch_dir, scratch.pnr_script_name, scratch._build_pnr_script())
+        if self.tool_session:
+            # scratch projects run on a thread pool, give each its own session
+            scratch.session = TclSession(self.session_cmd, self.session_timeout)
+        return scratch
+
+    def _kary_fmax_search(self):
+        '''
+        Speculative Tmin search: each round places and routes fmax_k
+        candidate periods at the same time, in scratch copies of the project.
+        Every round narrows the bracket by a factor of fmax_k + 1 instead of
+        2, so the number of rounds is chosen to match the precision of
+        fmax_search_steps binary steps. Stops early once the search converges.
+
+        The routed results of the best passing period are copied back into
+        the project, so no final re-run is needed.
+
+        Returns the list of guesses, formatted as '<period> too [high|low]'
+        '''
+        k = self.fmax_k
+        rounds = max(1, math.ceil(self._search_steps()/math.log2(k + 1)))
+        scratch = [self._make_scratch_project(idx) for idx in range(k)]
+
+        too_low = None
+        too_high = None
+        guesses = []
+        with concurrent.futures.ThreadPoolExecutor(k) as pool:
+            for _ in range(rounds):
+                if self._converged(too_low, too_high):
                     break
-            self.period_ns = tmin
-            self._write_sdc(self.period_ns)
-            self._run_pnr_tool()
-            print('\tPNR: '+self.proj_dir+' Last guess failed, re-running last successful')
-        else:
-            print('\tPNR: '+self.proj_dir+' Last guess successful')
+                periods = self._kary_candidates(too_low, too_high)
+                # a warm started search widens its spread until it finds a
+                # bracket
+                if too_low is None or too_high is None:
+                    self.coef = min(0.5, self.coef*2)
+                results = list(pool.map(AbstractFPGATool._run_pnr_iteration, scratch, periods))
 
-        stop = time.time()
-        elapsed = stop - start
+                best = None
+                for idx, (period, success) in enumerate(zip(periods, results)):
+                    if success and (too_high is None or period < too_high):
+                        too_high = period
+                        best = idx
+                    elif not success and (too_low is None or period > too_low):
+                        too_low = period
 
-        success = True
-        # TODO
+                # keep the routed results of the best passing period so far
+                if best is not None:
+                    self._copy_outputs(self.pnr_outputs, scratch[best].proj_dir, self.proj_dir)
+                    self._routed_period = self._sdc_period(too_high)
 
-        # report the results of the Tmin search
-        self._report_result(success, elapsed, 'pnr')
-        # record the value of Tmin found
-        self._write_file(self.proj_dir, 'tmin.txt', guesses)
+                # passes (descending) then failures (ascending), so the last
+                # 'too high' and 'too low' lines are the tightest bracket
+                passed = sorted([p for p, r in zip(periods, results) if r], reverse=True)
+                failed = sorted([p for p, r in zip(periods, results) if not r])
+                guesses = guesses + [str(p)+' too high' for p in passed]
+                guesses = guesses + [str(p)+' too low' for p in failed]
+
+        for project in scratch:
+            if project.session is not None:
+                project.session.close()
+            shutil.rmtree(project.proj_dir)
+
+        self._restore_best(too_high)
+        return guesses
+
+    def _read_slack(self):
+        '''
+        Read the worst setup slack (in ns) of the last PnR run from its timing
+        report.
+
+        Returns None if the tool does not report it or it could not be found.
+        '''
+        return self._read_report(self.pnr_logfile_name, self.pnr_report).wns
+
+    def _next_slack_guess(self, period, slack, too_low, too_high):
+        '''
+        Choose the next period for the slack guided search. The design's
+        critical path is estimated as <period> - <slack>, moved at least the
+        search tolerance past <period> so that every run tightens the bracket.
+        Estimates that are missing, more than a factor of 2 from <period>, or
+        outside the current bracket fall back to bisecting the bracket.
+        '''
+        guess = None
+        if slack is not None:
+            guess = period - slack
+            step = max(self.fmax_abs_tol, self.fmax_rel_tol*period)
+            if slack >= 0:
+                guess = min(guess, period - step)
+            else:
+                guess = max(guess, period + step)
+            if guess < period/2 or guess > period*2:
+                guess = None
+            elif too_low is not None and guess <= too_low:
+                guess = None
+            elif too_high is not None and guess >= too_high:
+                guess = None
+        if guess is not None:
+            return guess
+        if too_low is not None and too_high is not None:
+            return (too_low + too_high)/2
+        elif too_high is not None:
+            return too_high/2
+        return too_low*2
+
+    def _slack_fmax_search(self):
+        '''
+        Slack guided Tmin search: after each PnR run jump straight to the
+        period the reported slack says the design can meet, instead of only
+        using whether timing was met. Falls back to bisection when the slack
+        is unusable. Stops once the search converges, or after as many runs as
+        the binary search.
+
+        Returns the list of guesses, formatted as '<period> too [high|low]'
+        '''
+        too_low = None
+        too_high = None
+        guesses = []
+        period = self.period_ns
+        for _ in range(self._search_steps()):
+            success = self._run_pnr_iteration(period)
+            if success:
+                guesses.append(str(period)+' too high')
+                too_high = period
+                self._keep_best(too_high)
+            else:
+                guesses.append(str(period)+' too low')
+                too_low = period
+            if self._converged(too_low, too_high):
+                break
+            period = self._next_slack_guess(period, self.last_slack, too_low, too_high)
+
+        # we don't want to report area numbers if timing wasn't met, so keep
+        # the results of the best passing guess
+        self._restore_best(too_high)
+        return guesses
 
     def _build_pnr_script(self):
         pass
@@ -212,12 +940,19 @@ class Quartus(AbstractFPGATool):
     tool_name = 'quartus'
 
     synth_script_name = 'quartus_synth_script.tcl'
-    synth_success_msg  = 'Info: Successfully synthesized'
     synth_logfile_name = os.path.join('output_files', 'autoqpf.syn.rpt')
+    synth_report = 'quartus_syn'
 
     pnr_script_name = 'quartus_pnr_script.tcl'
-    pnr_success_msg = 'Quartus Prime Timing Analyzer was successful. 0 errors, 0 warnings'
     pnr_logfile_name = os.path.join('output_files', 'autoqpf.sta.rpt')
+    pnr_report = 'quartus_sta'
+
+    util_logfile_name = os.path.join('output_files', 'autoqpf.fit.rpt')
+    util_report = 'quartus_fit'
+    area_metric = 'alms'
+    pnr_outputs = ['output_files']
+    part = '10AS016E3F27E1HG'
+    synth_outputs = ['autoqpf.qpf', 'autoqpf.qsf', 'db', 'qdb', 'output_files']
 
     sdc_name = 'quartus_sdc.sdc'
     fmax_search_steps = 10
@@ -243,11 +978,12 @@ class Quartus(AbstractFPGATool):
             #'set_global_assignment -name DEVICE 1SG085HN1F43E1VG', # 280k ALM ~ 841k LE
             #'set_global_assignment -name FAMILY "Stratix 10"',
             #'set_global_assignment -name DEVICE 10AX016C3U19E2LG', # 62k ALM ~ 160k LE, 196 user IO
-            'set_global_assignment -name DEVICE 10AS016E3F27E1HG', # 62k ALM ~ 240 user IO
+            'set_global_assignment -name DEVICE '+self.part, # 62k ALM ~ 240 user IO
             'set_global_assignment -name FAMILY "Arria 10"',
             #'set_global_assignment -name DEVICE 10CX085YF672E5G', # 31k ALM -- No license
             #'set_global_assignment -name FAMILY "Cyclone 10"',
             'set_global_assignment -name PROJECT_OUTPUT_DIRECTORY output_files',
+            'set_global_assignment -name NUM_PARALLEL_PROCESSORS '+str(self.threads),
             *quartus_extra_commands,
             'set sources [glob src/*]',
             'foreach src $sources {',
@@ -277,6 +1013,7 @@ class Quartus(AbstractFPGATool):
         pnr_script = [
             'project_open autoqpf',
             'set_global_assignment -name SDC_FILE '+self.sdc_name,
+            'set_global_assignment -name NUM_PARALLEL_PROCESSORS '+str(self.threads),
             'project_close',
         ]
         return pnr_script
@@ -296,17 +1033,91 @@ class Vivado(AbstractFPGATool):
     tool_name = 'vivado'
 
     synth_script_name = 'vivado_synth_script.tcl'
-    synth_success_msg  = 'synth_design completed successfully'
     synth_logfile_name = 'vivado.log'
+    synth_report = 'vivado_log'
 
     pnr_script_name = 'vivado_pnr_script.tcl'
-    pnr_success_msg = 'Slack (MET) :'
     pnr_logfile_name = os.path.join('autoxpr', 'timing.log')
+    pnr_report = 'vivado_timing'
+
+    util_logfile_name = os.path.join('autoxpr', 'util.log')
+    util_report = 'vivado_util'
+    pnr_outputs = [
+        os.path.join('autoxpr', 'timing.log'),
+        os.path.join('autoxpr', 'util.log'),
+        os.path.join('autoxpr', 'autopnrxpr.dcp'),
+    ]
 
     sdc_name = 'vivado_sdc.sdc'
     fmax_search_steps = 10
     period_ns = 6
 
+    session_cmd = ['vivado', '-mode', 'tcl', '-nojournal', '-nolog']
+
+    part = 'xcvu3p-ffvc1517-3-e'
+    synth_outputs = ['vivado.log', os.path.join('autoxpr', 'autosynthxpr.dcp')]
+
+    # 'intool' runs the whole Tmin search in a single Vivado run
+    fmax_searches = AbstractFPGATool.fmax_searches + ['intool']
+    fmax_results_name = os.path.join('autoxpr', 'fmax_search.txt')
+
+    flows = ['scratch', 'incremental']
+    outputdir = 'autoxpr'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.flow == 'incremental':
+            # the incremental flow has its own scripts, logs and outputs
+            self.outputdir = 'autoxpr_incr'
+            self.synth_script_name = 'vivado_synth_incr_script.tcl'
+            self.synth_logfile_name = 'vivado_incr.log'
+            self.pnr_script_name = 'vivado_pnr_incr_script.tcl'
+            self.sdc_name = 'vivado_sdc_incr.sdc'
+            self.pnr_logfile_name = os.path.join(self.outputdir, 'timing.log')
+            self.util_logfile_name = os.path.join(self.outputdir, 'util.log')
+            self.pnr_outputs = [
+                os.path.join(self.outputdir, 'timing.log'),
+                os.path.join(self.outputdir, 'util.log'),
+                os.path.join(self.outputdir, 'autopnrxpr.dcp'),
+            ]
+            self.synth_outputs = [self.synth_logfile_name, os.path.join(self.outputdir, 'autosynthxpr.dcp')]
+            self.fmax_results_name = os.path.join(self.outputdir, 'fmax_search.txt')
+
+    def _reference_checkpoint(self, name):
+        '''
+        Returns the absolute path of the checkpoint <name> of the previous
+        commit in the incremental flow, or None if there is none.
+        '''
+        if self.flow != 'incremental' or self.reference is None:
+            return None
+        dcp = os.path.abspath(os.path.join(self.reference.proj_dir, self.reference.outputdir, name))
+        if not os.path.isfile(dcp):
+            return None
+        return dcp
+
+    def _vivado_cmd(self, script_name):
+        '''
+        Returns the command that runs <script_name> in Vivado's batch Tcl mode
+        '''
+        cmd = ['vivado', '-mode', 'tcl', '-source', script_name]
+        if self.flow == 'incremental':
+            # don't overwrite the from scratch run's vivado.log
+            cmd = cmd + ['-log', self.synth_logfile_name]
+        return cmd
+
+    def _end_of_script(self):
+        '''
+        The last commands of a Vivado script. In a tool session Vivado must
+        stay open for the next script, so the script closes its design
+        instead of exiting.
+        '''
+        if self.tool_session:
+            return [
+                'catch {close_design}',
+                'catch {close_project}',
+            ]
+        return ['exit']
+
     def _build_synth_script(self):
         '''
         Create a tcl script to run Vivado synthesis
@@ -324,23 +1135,33 @@ class Vivado(AbstractFPGATool):
         # get the benchmark top module
         top = self.cbb.benchmark['top']
 
+        # incremental synthesis starts from the previous commit's netlist
+        incremental_commands = []
+        if self.flow == 'incremental':
+            reference = self._reference_checkpoint('autosynthxpr.dcp')
+            if reference is not None:
+                incremental_commands = ['read_checkpoint -incremental '+reference]
+            vivado_synth_args = vivado_synth_args+' -incremental_mode default'
+
         # create the synth script
         synth_script = [
-            'set outputdir autoxpr',
+            'set outputdir '+self.outputdir,
+            'set_param general.maxThreads '+str(self.threads),
             'set project autosynth',
-            'set partnumber xcvu3p-ffvc1517-3-e',
+            'set partnumber '+self.part,
             'file mkdir $outputdir',
             'create_project -part $partnumber $project $outputdir',
             'add_files src',
             'set_property top '+top+' [current_fileset]',
             'update_compile_order',
             *vivado_extra_commands,
+            *incremental_commands,
             'set synth_args {'+vivado_synth_args+'}',
             'catch {',
             '   synth_design -top '+top+' {*}$synth_args',
             '   write_checkpoint $outputdir/autosynthxpr.dcp',
             '}',
-            'exit',
+            *self._end_of_script(),
         ]
         return synth_script
 
@@ -349,20 +1170,32 @@ class Vivado(AbstractFPGATool):
         Run Vivado in headless mode to execute the synthscript in the commit
         level project directory. Assume Vivado is on the path.
         '''
-        subprocess.run(['vivado', '-mode', 'tcl', '-source', self.synth_script_name], cwd=self.proj_dir, capture_output=True)
+        if self.tool_session:
+            self._source_in_session(self.synth_script_name, self.synth_logfile_name)
+            return
+        subprocess.run(self._vivado_cmd(self.synth_script_name), cwd=self.proj_dir, capture_output=True)
 
     def _build_pnr_script(self):
         '''
         Vivado PNR script. Opens a synthesized DCP, places and routes it, and
         then writes out timing information.
         '''
+        if self.fmax_search == 'intool':
+            return self._build_fmax_search_script()
+        # incremental implementation starts from the previous commit's
+        # placement and routing
+        incremental_commands = []
+        reference = self._reference_checkpoint('autopnrxpr.dcp')
+        if reference is not None:
+            incremental_commands = ['   read_checkpoint -incremental '+reference]
         pnr_script = [
-            'set outputdir autoxpr',
-            'set_param general.maxThreads 1', # suspect multiple multithreaded instances cause issues
+            'set outputdir '+self.outputdir,
+            'set_param general.maxThreads '+str(self.threads), # suspect multiple multithreaded instances cause issues, so 1 unless CPUs are allocated
             'open_checkpoint $outputdir/autosynthxpr.dcp',
-            'source vivado_sdc.sdc',
+            'source '+self.sdc_name,
             'catch {',
             '   opt_design',
+            *incremental_commands,
             #'  power_opt_design', # optional
             '   place_design',
             #'  power_opt_design', # optional
@@ -373,13 +1206,153 @@ class Vivado(AbstractFPGATool):
             '   report_utilization -file $outputdir/util.log',
             '   write_checkpoint -force $outputdir/autopnrxpr.dcp',
             '}',
-            'exit'
+            *self._end_of_script(),
         ]
         return pnr_script
 
+    def _build_fmax_search_script(self):
+        '''
+        Vivado script that runs the binary Tmin search of
+        _binary_fmax_search() inside Vivado. The synthesized DCP is opened and
+        optimized once, then for each guess the design is placed and routed,
+        and unplaced again afterwards. The timing reports and DCP of the best
+        passing guess are written as for a single PnR run.
+
+        Each guess is written to the results file as a line formatted as
+        '<period> <1 if timing was met, else 0> <worst slack> <runtime>'
+        '''
+        clock_name = self.cbb.clock
+        pnr_script = [
+            'set outputdir '+self.outputdir,
+            'set_param general.maxThreads '+str(self.threads), # suspect multiple multithreaded instances cause issues, so 1 unless CPUs are allocated
+            'open_checkpoint $outputdir/autosynthxpr.dcp',
+            'set period '+str(self.period_ns),
+            'set coef '+str(self.coef),
+            'set gallop '+str(int(self.warm_started)),
+            'set steps '+str(self._search_steps()),
+            'set max_steps '+str(self.fmax_search_steps),
+            'set abs_tol '+str(self.fmax_abs_tol),
+            'set rel_tol '+str(self.fmax_rel_tol),
+            'set too_low {}',
+            'set too_high {}',
+            'set last {}',
+            'set results [open '+self.fmax_results_name+' w]',
+            'create_clock -name '+clock_name+' -period [format %.2f $period] [get_ports '+clock_name+']',
+            'catch {opt_design}',
+            'set runs 0',
+            'while {$runs < $steps} {',
+            '   if {$too_low ne {} && $too_high ne {} && $too_high - $too_low <= max($abs_tol, $rel_tol*$too_high)} {',
+            '      break',
+            '   }',
+            '   set start [clock milliseconds]',
+            '   create_clock -name '+clock_name+' -period [format %.2f $period] [get_ports '+clock_name+']',
+            '   set met 0',
+            '   set slack {}',
+            '   if {![catch {place_design; route_design}]} {',
+            '      set slack [get_property SLACK [get_timing_paths -max_paths 1 -setup]]',
+            '      if {$slack ne {} && $slack >= 0} {',
+            '         set met 1',
+            '      }',
+            '   }',
+            '   puts $results "$period $met $slack [expr {([clock milliseconds] - $start)/1000.0}]"',
+            '   flush $results',
+            '   incr runs',
+            '   if {$met} {',
+            '      if {$too_high eq {} || $period < $too_high} {',
+            '         set too_high $period',
+            '         report_timing -file $outputdir/timing.log',
+            '         report_utilization -file $outputdir/util.log',
+            '         write_checkpoint -force $outputdir/autopnrxpr.dcp',
+            '      }',
+            '      if {$last eq {low}} {',
+            '         set coef [expr {$coef/2}]',
+            '         set gallop 0',
+            '      } elseif {$last eq {high} && $gallop} {',
+            '         set coef [expr {min(0.5, $coef*2)}]',
+            '         set steps [expr {min($max_steps, $steps + 1)}]',
+            '      }',
+            '      set period [expr {$period*(1 - $coef)}]',
+            '      set last high',
+            '   } else {',
+            '      if {$too_low eq {} || $period > $too_low} {',
+            '         set too_low $period',
+            '      }',
+            '      if {$last eq {high}} {',
+            '         set coef [expr {$coef/2}]',
+            '         set gallop 0',
+            '      } elseif {$last eq {low} && $gallop} {',
+            '         set coef [expr {min(0.5, $coef*2)}]',
+            '         set steps [expr {min($max_steps, $steps + 1)}]',
+            '      }',
+            '      set period [expr {$period*(1 + $coef)}]',
+            '      set last low',
+            '   }',
+            '   catch {route_design -unroute}',
+            '   catch {place_design -unplace}',
+            '}',
+            'close $results',
+            *self._end_of_script(),
+        ]
+        return pnr_script
+
+    def _intool_fmax_search(self):
+        '''
+        Run the Tmin search built by _build_fmax_search_script() in one
+        Vivado run, and read back its guesses.
+
+        Returns the list of guesses, formatted as '<period> too [high|low]'
+        '''
+        # don't pick up the results of an earlier search
+        for name in [self.fmax_results_name, self.pnr_logfile_name]:
+            path = os.path.join(self.proj_dir, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+        self._run_pnr_tool()
+
+        too_high = None
+        guesses = []
+        try:
+            with open(os.path.join(self.proj_dir, self.fmax_results_name), 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    period = float(fields[0])
+                    print('\tPNR: '+self.proj_dir+' @ T='+fields[0]+'ns (RT: '+fields[-1]+')')
+                    # the guesses share one tool run, so only the step's
+                    # resource use is measured
+                    try:
+                        slack = float(fields[2])
+                    except ValueError:
+                        slack = None # not reported
+                    self._record_run(self._sdc_period(period), fields[1] == '1', slack, float(fields[-1]), {})
+                    if fields[1] == '1':
+                        guesses.append(fields[0]+' too high')
+                        if too_high is None or period < too_high:
+                            too_high = period
+                    else:
+                        guesses.append(fields[0]+' too low')
+        except FileNotFoundError:
+            print('WARNING: '+self.proj_dir+': Vivado did not write any Tmin search results')
+
+        if too_high is None:
+            print('\tPNR: '+self.proj_dir+' No guess met timing')
+        else:
+            self.period_ns = too_high
+            self._write_sdc(self.period_ns)
+            print('\tPNR: '+self.proj_dir+' Best guess T='+str(too_high)+'ns kept')
+        return guesses
+
     def _run_pnr_tool(self):
         '''
         Run Vivado in headless mode to exec the pnr script. Assumes Vivado is
         on the path.
         '''
-        subprocess.run(['vivado', '-mode', 'tcl', '-source', self.pnr_script_name], cwd=self.proj_dir, capture_output=True)
+        if self.tool_session:
+            # don't let a crashed run leave the last run's timing report
+            # behind
+            logfile = os.path.join(self.proj_dir, self.pnr_logfile_name)
+            if os.path.isfile(logfile):
+                os.remove(logfile)
+            self._source_in_session(self.pnr_script_name, self.synth_logfile_name)
+            return
+        subprocess.run(self._vivado_cmd(self.pnr_script_name), cwd=self.proj_dir, capture_output=True)
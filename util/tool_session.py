@@ -0,0 +1,165 @@
+import os
+import subprocess
+import threading
+import queue
+import itertools
+
+class ToolSessionError(Exception):
+    '''
+    A tool session crashed or stopped responding, and could not be recovered.
+    '''
+    pass
+
+def _pump_lines(stdout, lines):
+    '''
+    Put each line of <stdout> on the queue <lines>, followed by None once the
+    process exits
+    '''
+    for line in stdout:
+        lines.put(line)
+    lines.put(None)
+
+class TclSession:
+    '''
+    A long-lived Tcl mode tool process (e.g. `vivado -mode tcl`, or `tclsh`)
+    that runs one script after another, so the tool's startup cost is only
+    paid once.
+
+    Commands are written to the tool's stdin. Each one is followed by a
+    `puts` of a sentinel line, holding a unique token and the command's
+    return code, so the end of its output can be found on stdout. If the tool
+    exits or does not reply within the timeout it is restarted.
+    '''
+    def __init__(self, cmd, timeout=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self._proc = None
+        self._lines = None
+        self._tokens = itertools.count()
+
+    def _start(self):
+        self._proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT, text=True, errors='replace')
+        # read stdout on a separate thread, so a hung tool can be timed out
+        self._lines = queue.Queue()
+        reader = threading.Thread(target=_pump_lines, args=(self._proc.stdout, self._lines), daemon=True)
+        reader.start()
+
+    def _stop(self, kill=False):
+        '''
+        Stop the tool process. If <kill> is True, or it does not exit on its
+        own, kill it.
+        '''
+        if self._proc is None:
+            return
+        if kill:
+            self._proc.kill()
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+        self._lines = None
+
+    def _send(self, commands):
+        '''
+        Send <commands> (a string) to the tool and wait for its sentinel.
+
+        Returns a tuple of (<return code>, [<output lines>]), or None if the
+        tool exited or timed out.
+        '''
+        if self._proc is None:
+            self._start()
+        sentinel = '__tcl_session_done_'+str(os.getpid())+'_'+str(next(self._tokens))
+        request = [
+            'set __tcl_session_rc [catch {'+commands+'} __tcl_session_msg]',
+            'if {$__tcl_session_rc != 0} {puts $__tcl_session_msg}',
+            'puts "'+sentinel+' $__tcl_session_rc"',
+            'flush stdout',
+        ]
+        try:
+            self._proc.stdin.write('\n'.join(request)+'\n')
+            self._proc.stdin.flush()
+        except OSError:
+            return None
+        output = []
+        while True:
+            try:
+                line = self._lines.get(timeout=self.timeout)
+            except queue.Empty:
+                return None
+            if line is None:
+                return None
+            if sentinel in line:
+                # anything before the sentinel (e.g. a prompt) is output
+                before, _, rc = line.partition(sentinel)
+                if before.strip() != '':
+                    output.append(before)
+                return (int(rc.split()[0]), output)
+            output.append(line)
+
+    def run(self, commands, transcript=None):
+        '''
+        Run <commands> (a string of Tcl) in the session. If the tool crashes
+        or times out it is restarted, and <commands> are retried once.
+
+        The output of the commands is written to the file <transcript>, if
+        given.
+
+        Returns the Tcl return code of the commands (0 if they succeeded).
+        Raises a ToolSessionError if the retry fails too.
+        '''
+        for _ in range(2):
+            result = self._send(commands)
+            if result is not None:
+                break
+            print('WARNING: '+' '.join(self.cmd)+' session stopped responding, restarting it')
+            self._stop(kill=True)
+        if result is None:
+            raise ToolSessionError(' '.join(self.cmd)+' failed twice running: '+commands)
+        if transcript is not None:
+            with open(transcript, 'w') as f:
+                f.writelines(result[1])
+        return result[0]
+
+    def source(self, script, cwd, transcript=None):
+        '''
+        Run the Tcl script file <script> with <cwd> as the working directory.
+        See run().
+        '''
+        return self.run('cd {'+os.path.abspath(cwd)+'}; source {'+script+'}', transcript)
+
+    def close(self):
+        self._stop()
+
+# sessions of the current thread, keyed by their command
+_sessions = threading.local()
+
+def get_session(cmd, timeout=None):
+    '''
+    Returns the calling thread's session running <cmd> (a list), starting it
+    if needed. Each thread (and process) gets its own sessions, so parallel
+    workers never share a tool process.
+    '''
+    if not hasattr(_sessions, 'by_cmd') or _sessions.pid != os.getpid():
+        # inherited from a parent process, do not touch its pipes
+        _sessions.by_cmd = {}
+        _sessions.pid = os.getpid()
+    key = tuple(cmd)
+    if key not in _sessions.by_cmd:
+        _sessions.by_cmd[key] = TclSession(cmd, timeout)
+    return _sessions.by_cmd[key]
+
+def close_sessions():
+    '''
+    Stop all of the calling thread's sessions
+    '''
+    if hasattr(_sessions, 'by_cmd') and _sessions.pid == os.getpid():
+        for session in _sessions.by_cmd.values():
+            session.close()
+        _sessions.by_cmd = {}